@@ -0,0 +1,120 @@
+"""Benchmark skalowania aplikacji przy wielu procesach roboczych uvicorn (GET /movies/{movie_id}).
+
+Użycie: python benchmark.py [czas_w_sekundach] [maks_liczba_procesów] [port]
+"""
+import http.client
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import time
+
+from main import get_db_connection
+
+SERVER_START_TIMEOUT = 30.0
+
+
+def _get(conn: http.client.HTTPConnection, movie_id: int) -> int:
+    conn.request('GET', f'/movies/{movie_id}')
+    response = conn.getresponse()
+    response.read()
+    return response.status
+
+
+def _client(port, movie_ids, duration, start_event, results):
+    conn = http.client.HTTPConnection('127.0.0.1', port)
+    start_event.wait()
+    deadline = time.perf_counter() + duration
+    requests = errors = 0
+    while time.perf_counter() < deadline:
+        try:
+            if _get(conn, random.choice(movie_ids)) != 200:
+                errors += 1
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            conn.close()  # Kolejne żądanie otworzy nowe połączenie
+        requests += 1
+    conn.close()
+    results.put((requests, errors))
+
+
+def start_server(workers: int, port: int, movie_id: int) -> subprocess.Popen:
+    """Uruchamia uvicorn main:app z podaną liczbą procesów i czeka, aż zacznie odpowiadać"""
+    server = subprocess.Popen([
+        sys.executable, '-m', 'uvicorn', 'main:app',
+        '--workers', str(workers), '--port', str(port), '--log-level', 'warning',
+    ])
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("Serwer zakończył działanie przy uruchamianiu")
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+        try:
+            if _get(conn, movie_id) == 200:
+                return server
+        except (OSError, http.client.HTTPException):
+            pass
+        finally:
+            conn.close()
+        time.sleep(0.2)
+    stop_server(server)
+    raise RuntimeError("Serwer nie odpowiada")
+
+
+def stop_server(server: subprocess.Popen):
+    server.terminate()
+    try:
+        server.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+
+
+def measure(workers: int, duration: float, movie_ids: list, port: int) -> tuple:
+    """Zwraca liczbę obsłużonych żądań na sekundę i liczbę błędów dla podanej liczby procesów serwera"""
+    server = start_server(workers, port, movie_ids[0])
+    try:
+        # Dwa klienty na proces serwera, żeby każdy proces miał zawsze żądanie do obsłużenia
+        start_event = multiprocessing.Event()
+        results = multiprocessing.Queue()
+        clients = [
+            multiprocessing.Process(target=_client, args=(port, movie_ids, duration, start_event, results))
+            for _ in range(2 * workers)
+        ]
+        for client in clients:
+            client.start()
+        start_event.set()
+        totals = [results.get() for _ in clients]
+        for client in clients:
+            client.join()
+    finally:
+        stop_server(server)
+    return sum(requests for requests, _ in totals) / duration, sum(errors for _, errors in totals)
+
+
+def main():
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 3.0
+    max_workers = int(sys.argv[2]) if len(sys.argv) > 2 else (os.cpu_count() or 1)
+    port = int(sys.argv[3]) if len(sys.argv) > 3 else 8765
+
+    conn = get_db_connection()
+    movie_ids = [row[0] for row in conn.execute('SELECT movieId FROM movies')]
+    conn.close()
+    if not movie_ids:
+        print("Baza danych nie zawiera filmów - uruchom najpierw python database.py")
+        sys.exit(1)
+
+    counts = sorted({1, max_workers} | {2 ** i for i in range(max_workers.bit_length()) if 2 ** i <= max_workers})
+    print(f"Procesory: {os.cpu_count()}, czas pomiaru: {duration}s (klienci działają na tej samej maszynie)")
+    print(f"{'procesy':>8} {'żądania/s':>12} {'przyspieszenie':>15} {'efektywność':>12} {'błędy':>7}")
+    baseline = None
+    for workers in counts:
+        throughput, errors = measure(workers, duration, movie_ids, port)
+        baseline = baseline or throughput
+        speedup = throughput / baseline
+        print(f"{workers:>8} {throughput:>12.0f} {speedup:>14.2f}x {speedup / workers:>11.0%} {errors:>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,27 @@
 import sqlite3
 import csv
-from typing import List
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from itertools import islice
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
 
-def create_database():
+def create_database(db_path: str = 'movies.db'):
     """Tworzy strukturę bazy danych"""
-    conn = sqlite3.connect('movies.db')
+    conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
 
+    # Tryb INCREMENTAL pozwala oddawać wolne strony po usunięciach małymi krokami
+    # (maintenance.py); działa tylko przed utworzeniem pierwszej tabeli
+    cursor.execute('PRAGMA auto_vacuum=INCREMENTAL')
+
+    # WAL pozwala czytelnikom z wielu procesów działać równolegle z zapisującym;
+    # tryb jest zapisywany w pliku bazy, więc wystarczy ustawić go raz
+    cursor.execute('PRAGMA journal_mode=WAL')
+
     # Tabela movies
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS movies (
@@ -51,76 +65,619 @@ def create_database():
         )
     ''')
 
+    # Słownik tagów: warianty różniące się wielkością liter i spacjami na końcach
+    # (ten sam tekst znormalizowany) mają jeden identyfikator i wspólny licznik użyć;
+    # tag to postać, w której tag pojawił się jako pierwszy
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS tag_vocabulary (
+            tagId INTEGER PRIMARY KEY,
+            tag TEXT NOT NULL,
+            normalized TEXT NOT NULL UNIQUE,
+            count INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_tag_vocabulary_count ON tag_vocabulary (count)')
+
+    # Liczniki tagów per film
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS movie_tag_counts (
+            movieId INTEGER,
+            tagId INTEGER,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (movieId, tagId),
+            FOREIGN KEY (tagId) REFERENCES tag_vocabulary (tagId)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_movie_tag_counts_count ON movie_tag_counts (movieId, count)')
+
+    # Agregaty ocen w kubełkach dziennych i tygodniowych (start kubełka jako timestamp)
+    for table in ROLLUP_TABLES:
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                movieId INTEGER,
+                bucket INTEGER,
+                count INTEGER NOT NULL,
+                total REAL NOT NULL,
+                PRIMARY KEY (movieId, bucket)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_bucket ON {table} (bucket, count)')
+
+    # Liczniki zmian tabel źródłowych - współdzielone przez wszystkie procesy,
+    # służą do unieważniania pamięci podręcznej w procesach roboczych
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS change_counters (
+            tbl TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.executemany(
+        'INSERT OR IGNORE INTO change_counters (tbl, version) VALUES (?, 0)',
+        [(table,) for table in SOURCE_TABLES],
+    )
+
+    # Ustawienia bazy (np. liczba shardów ocen i tagów, generacja danych, granica przycięcia dziennika)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS settings (
+            name TEXT PRIMARY KEY,
+            value TEXT
+        )
+    ''')
+    cursor.execute(
+        "INSERT OR IGNORE INTO settings (name, value) VALUES ('generation', lower(hex(randomblob(8))))"
+    )
+
+    # Dziennik zmian dla odbiorców synchronizujących się przyrostowo (GET /changes);
+    # AUTOINCREMENT gwarantuje, że numery nie są używane ponownie po przycięciu dziennika
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS change_log (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            tbl TEXT NOT NULL,
+            op TEXT NOT NULL,
+            key TEXT NOT NULL,
+            payload TEXT
+        )
+    ''')
+
+    # Wyzwalacze utrzymujące słownik tagów, agregaty ocen, liczniki i dziennik zmian
+    create_triggers(cursor)
+
+    # Baza sprzed wprowadzenia słownika: liczniki trzeba policzyć z istniejących tagów
+    cursor.execute('SELECT EXISTS (SELECT 1 FROM tag_vocabulary), EXISTS (SELECT 1 FROM tags)')
+    has_vocabulary, has_tags = cursor.fetchone()
+    if has_tags and not has_vocabulary:
+        rebuild_tag_vocabulary(cursor)
+
+    # Podobnie agregaty ocen
+    cursor.execute('SELECT EXISTS (SELECT 1 FROM rating_rollups_daily), EXISTS (SELECT 1 FROM ratings)')
+    has_rollups, has_ratings = cursor.fetchone()
+    if has_ratings and not has_rollups:
+        rebuild_rating_rollups(cursor)
+
     conn.commit()
     conn.close()
 
 
-def load_data_from_csv():
-    """Ładuje dane z plików CSV do bazy danych"""
-    conn = sqlite3.connect('movies.db')
-    cursor = conn.cursor()
+_TAG_COUNT_INCREMENT = '''
+            INSERT INTO tag_vocabulary (tag, normalized, count)
+                VALUES ({row}.tag, lower(trim({row}.tag)), 1)
+                ON CONFLICT (normalized) DO UPDATE SET count = count + 1;
+            INSERT INTO movie_tag_counts (movieId, tagId, count)
+                SELECT {row}.movieId, tagId, 1 FROM tag_vocabulary WHERE normalized = lower(trim({row}.tag))
+                ON CONFLICT (movieId, tagId) DO UPDATE SET count = count + 1;'''
 
-    # Wczytaj filmy
-    try:
-        with open('movies.csv', 'r', encoding='utf-8') as file:
-            reader = csv.reader(file)
-            next(reader)  # Pomijamy nagłówek
-            for row in reader:
-                if len(row) >= 3:
-                    cursor.execute(
-                        'INSERT OR IGNORE INTO movies (movieId, title, genres) VALUES (?, ?, ?)',
-                        (int(row[0]), row[1], row[2])
-                    )
-    except FileNotFoundError:
-        print("Plik movies.csv nie został znaleziony")
-
-    # Wczytaj linki
-    try:
-        with open('links.csv', 'r', encoding='utf-8') as file:
-            reader = csv.reader(file)
-            next(reader)
-            for row in reader:
-                if len(row) >= 3:
-                    cursor.execute(
-                        'INSERT OR IGNORE INTO links (movieId, imdbId, tmdbId) VALUES (?, ?, ?)',
-                        (int(row[0]), row[1], row[2] if row[2] != '' else None)
-                    )
-    except FileNotFoundError:
-        print("Plik links.csv nie został znaleziony")
-
-    # Wczytaj oceny
+_TAG_COUNT_DECREMENT = '''
+            UPDATE tag_vocabulary SET count = count - 1 WHERE normalized = lower(trim({row}.tag));
+            UPDATE movie_tag_counts SET count = count - 1
+                WHERE movieId = {row}.movieId
+                AND tagId = (SELECT tagId FROM tag_vocabulary WHERE normalized = lower(trim({row}.tag)));
+            DELETE FROM movie_tag_counts WHERE movieId = {row}.movieId AND count <= 0;'''
+
+
+def rebuild_tag_vocabulary(cursor: sqlite3.Cursor):
+    """Przelicza słownik tagów i liczniki per film od zera na podstawie tabeli tags"""
+    cursor.execute('DELETE FROM movie_tag_counts')
+    cursor.execute('UPDATE tag_vocabulary SET count = 0')
+    cursor.execute('''
+        INSERT INTO tag_vocabulary (tag, normalized, count)
+            SELECT MIN(tag), lower(trim(tag)), COUNT(*) FROM tags WHERE tag IS NOT NULL GROUP BY 2
+            ON CONFLICT (normalized) DO UPDATE SET count = excluded.count
+    ''')
+    cursor.execute('''
+        INSERT INTO movie_tag_counts (movieId, tagId, count)
+            SELECT t.movieId, v.tagId, COUNT(*)
+            FROM tags t JOIN tag_vocabulary v ON v.normalized = lower(trim(t.tag))
+            GROUP BY t.movieId, v.tagId
+    ''')
+
+
+DAY = 86400
+
+# Wyrażenia SQL wyznaczające początek kubełka dla kolumny timestamp;
+# tygodnie zaczynają się w poniedziałek (1970-01-01 był czwartkiem)
+ROLLUP_TABLES = {
+    'rating_rollups_daily': '({ts} / 86400) * 86400',
+    'rating_rollups_weekly': '((({ts} / 86400 + 3) / 7) * 7 - 3) * 86400',
+}
+
+
+def week_start(timestamp: int) -> int:
+    """Zwraca początek tygodnia (poniedziałek, UTC) zawierającego timestamp"""
+    return ((timestamp // DAY + 3) // 7 * 7 - 3) * DAY
+
+
+def _rollup_increment(row: str) -> str:
+    return ''.join(f'''
+            INSERT INTO {table} (movieId, bucket, count, total)
+                VALUES ({row}.movieId, {bucket.format(ts=f'{row}.timestamp')}, 1, {row}.rating)
+                ON CONFLICT (movieId, bucket) DO UPDATE
+                SET count = count + 1, total = total + excluded.total;'''
+                   for table, bucket in ROLLUP_TABLES.items())
+
+
+def _rollup_decrement(row: str) -> str:
+    statements = []
+    for table, bucket in ROLLUP_TABLES.items():
+        condition = f"movieId = {row}.movieId AND bucket = {bucket.format(ts=f'{row}.timestamp')}"
+        statements.append(f'''
+            UPDATE {table} SET count = count - 1, total = total - {row}.rating WHERE {condition};
+            DELETE FROM {table} WHERE {condition} AND count <= 0;''')
+    return ''.join(statements)
+
+
+def rebuild_rating_rollups(cursor: sqlite3.Cursor):
+    """Przelicza dzienne i tygodniowe agregaty ocen od zera na podstawie tabeli ratings"""
+    for table, bucket in ROLLUP_TABLES.items():
+        cursor.execute(f'DELETE FROM {table}')
+        cursor.execute(f'''
+            INSERT INTO {table} (movieId, bucket, count, total)
+                SELECT movieId, {bucket.format(ts='timestamp')}, COUNT(*), SUM(rating)
+                FROM ratings WHERE timestamp IS NOT NULL AND rating IS NOT NULL
+                GROUP BY 1, 2
+        ''')
+
+
+# Tabele źródłowe: kolumny oraz kolumny klucza głównego
+SOURCE_TABLES = {
+    'movies': (('movieId', 'title', 'genres'), ('movieId',)),
+    'links': (('movieId', 'imdbId', 'tmdbId'), ('movieId',)),
+    'ratings': (('userId', 'movieId', 'rating', 'timestamp'), ('userId', 'movieId')),
+    'tags': (('userId', 'movieId', 'tag', 'timestamp'), ('userId', 'movieId', 'tag')),
+}
+
+
+def _change_trigger(table: str, event: str) -> str:
+    """Wyzwalacz podbijający licznik zmian tabeli i dopisujący zmianę do dziennika zmian"""
+    columns, key = SOURCE_TABLES[table]
+
+    def key_sql(row):
+        return 'json_array(' + ', '.join(f'{row}.{column}' for column in key) + ')'
+
+    def payload_sql(row):
+        return 'json_object(' + ', '.join(f"'{column}', {row}.{column}" for column in columns) + ')'
+
+    row = 'OLD' if event == 'DELETE' else 'NEW'
+    moved_key = ''
+    if event == 'UPDATE':
+        # Zmiana klucza to dla odbiorcy usunięcie starego wiersza i zapis nowego
+        moved_key = f'''
+                INSERT INTO change_log (tbl, op, key, payload)
+                    SELECT '{table}', 'delete', {key_sql('OLD')}, {payload_sql('OLD')}
+                    WHERE {key_sql('OLD')} IS NOT {key_sql('NEW')};'''
+    return f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_changes_{event.lower()} AFTER {event} ON {table}
+            BEGIN
+                UPDATE change_counters SET version = version + 1 WHERE tbl = '{table}';{moved_key}
+                INSERT INTO change_log (tbl, op, key, payload)
+                    VALUES ('{table}', '{event.lower()}', {key_sql(row)}, {payload_sql(row)});
+            END'''
+
+
+def _triggers() -> Dict[str, str]:
+    """Zwraca definicje wyzwalaczy utrzymujących liczniki zmian, dziennik zmian i tabele pochodne (nazwa -> SQL)"""
+    triggers = {
+        f'{table}_changes_{event.lower()}': _change_trigger(table, event)
+        for table in SOURCE_TABLES
+        for event in ('INSERT', 'UPDATE', 'DELETE')
+    }
+    triggers.update({
+        'tags_vocabulary_insert': f'''
+            CREATE TRIGGER IF NOT EXISTS tags_vocabulary_insert AFTER INSERT ON tags
+            BEGIN
+                {_TAG_COUNT_INCREMENT.format(row='NEW')}
+            END''',
+        'tags_vocabulary_delete': f'''
+            CREATE TRIGGER IF NOT EXISTS tags_vocabulary_delete AFTER DELETE ON tags
+            BEGIN
+                {_TAG_COUNT_DECREMENT.format(row='OLD')}
+            END''',
+        'tags_vocabulary_update': f'''
+            CREATE TRIGGER IF NOT EXISTS tags_vocabulary_update AFTER UPDATE OF movieId, tag ON tags
+            BEGIN
+                {_TAG_COUNT_DECREMENT.format(row='OLD')}
+                {_TAG_COUNT_INCREMENT.format(row='NEW')}
+            END''',
+        'ratings_rollups_insert': f'''
+            CREATE TRIGGER IF NOT EXISTS ratings_rollups_insert AFTER INSERT ON ratings
+            BEGIN
+                {_rollup_increment('NEW')}
+            END''',
+        'ratings_rollups_delete': f'''
+            CREATE TRIGGER IF NOT EXISTS ratings_rollups_delete AFTER DELETE ON ratings
+            BEGIN
+                {_rollup_decrement('OLD')}
+            END''',
+        'ratings_rollups_update': f'''
+            CREATE TRIGGER IF NOT EXISTS ratings_rollups_update
+            AFTER UPDATE OF movieId, rating, timestamp ON ratings
+            BEGIN
+                {_rollup_decrement('OLD')}
+                {_rollup_increment('NEW')}
+            END''',
+    })
+    return triggers
+
+
+def create_triggers(cursor: sqlite3.Cursor):
+    """Tworzy wyzwalacze utrzymujące tabele pochodne"""
+    for sql in _triggers().values():
+        cursor.execute(sql)
+
+
+def drop_triggers(cursor: sqlite3.Cursor):
+    """Usuwa wyzwalacze tabel pochodnych (np. na czas ładowania dużej ilości danych)"""
+    for name in _triggers():
+        cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+
+
+DERIVED_TABLES = ('tag_vocabulary', 'movie_tag_counts') + tuple(ROLLUP_TABLES)
+
+
+def rebuild_derived_tables(cursor: sqlite3.Cursor):
+    """Przelicza wszystkie tabele pochodne na podstawie tabel źródłowych"""
+    rebuild_tag_vocabulary(cursor)
+    rebuild_rating_rollups(cursor)
+    mark_bulk_replaced(cursor)
+
+
+def mark_bulk_replaced(cursor: sqlite3.Cursor):
+    """Podbija liczniki zmian i nadaje nową generację danych po masowej wymianie tabel"""
+    cursor.execute('UPDATE change_counters SET version = version + 1')
+    # Masowa wymiana danych omija dziennik zmian - nowa generacja unieważnia
+    # struktury budowane przyrostowo z dziennika (np. indeks ocen rating_index)
+    cursor.execute(
+        "INSERT OR REPLACE INTO settings (name, value) VALUES ('generation', lower(hex(randomblob(8))))"
+    )
+
+
+CHANGE_LOG_RETENTION = 100000
+
+
+def get_change_log_horizon(cursor: sqlite3.Cursor) -> int:
+    """Zwraca numer, do którego (włącznie) wpisy dziennika zmian zostały usunięte"""
+    cursor.execute("SELECT value FROM settings WHERE name = 'change_log_horizon'")
+    row = cursor.fetchone()
+    return int(row[0]) if row else 0
+
+
+def prune_change_log(cursor: sqlite3.Cursor, keep: int = CHANGE_LOG_RETENTION) -> int:
+    """Usuwa z dziennika zmian wszystko poza ostatnimi keep numerami; zwraca liczbę usuniętych wpisów"""
+    cursor.execute('SELECT COALESCE(MAX(seq), 0) FROM change_log')
+    horizon = cursor.fetchone()[0] - keep
+    if horizon <= get_change_log_horizon(cursor):
+        return 0
+    cursor.execute('DELETE FROM change_log WHERE seq <= ?', (horizon,))
+    deleted = cursor.rowcount
+    cursor.execute(
+        "INSERT OR REPLACE INTO settings (name, value) VALUES ('change_log_horizon', ?)", (str(horizon),)
+    )
+    return deleted
+
+
+SHARDED_TABLES = ('ratings', 'tags')
+
+
+def get_shard_count(cursor: sqlite3.Cursor) -> int:
+    """Zwraca liczbę plików, na które podzielone są oceny i tagi (1 - wszystko w bazie głównej)"""
+    cursor.execute("SELECT value FROM settings WHERE name = 'shards'")
+    row = cursor.fetchone()
+    return int(row[0]) if row else 1
+
+
+def shard_paths(db_path: str, count: int) -> List[str]:
+    """Zwraca ścieżki plików z ocenami i tagami; bez podziału jest to sama baza główna"""
+    if count <= 1:
+        return [db_path]
+    stem, ext = os.path.splitext(db_path)
+    return [f'{stem}.shard{index}-of-{count}{ext}' for index in range(count)]
+
+
+def shard_index(user_id: int, count: int) -> int:
+    """Wyznacza shard użytkownika; wszystkie oceny i tagi użytkownika trafiają do jednego pliku"""
+    return user_id % count
+
+
+def _route_rows(rows: Iterable[tuple], count: int) -> Dict[int, List[tuple]]:
+    """Dzieli wiersze (userId w pierwszej kolumnie) między shardy"""
+    routed: Dict[int, List[tuple]] = {}
+    for row in rows:
+        routed.setdefault(shard_index(row[0], count), []).append(row)
+    return routed
+
+
+def intern_tags(cursor: sqlite3.Cursor, tags: Iterable[str]):
+    """Dopisuje teksty tagów do słownika bazy głównej, który przy podziale na shardy nadaje globalne tagId"""
+    cursor.executemany(
+        'INSERT OR IGNORE INTO tag_vocabulary (tag, normalized, count) VALUES (?, lower(trim(?)), 0)',
+        ((tag, tag) for tag in tags),
+    )
+
+
+def _open_shards(conn: sqlite3.Connection, db_path: str, count: int) -> List[sqlite3.Connection]:
+    """Otwiera pliki shardów (tworząc ich strukturę) z wyłączonymi wyzwalaczami"""
+    shards = []
+    for path in shard_paths(db_path, count):
+        if path == db_path:
+            shards.append(conn)
+            continue
+        create_database(path)
+        shard = sqlite3.connect(path)
+        shard.execute('BEGIN IMMEDIATE')  # Usunięcie wyzwalaczy w tej samej transakcji co zapis danych
+        drop_triggers(shard.cursor())
+        shards.append(shard)
+    return shards
+
+
+def _rollback_shards(conn: sqlite3.Connection, shards: List[sqlite3.Connection]):
+    """Wycofuje niezatwierdzone zmiany shardów (razem z usunięciem wyzwalaczy) i zamyka je"""
+    for shard in shards:
+        if shard is not conn:
+            shard.rollback()
+            shard.close()
+
+
+def _finish_shards(conn: sqlite3.Connection, shards: List[sqlite3.Connection]):
+    """Przelicza tabele pochodne shardów i przywraca ich wyzwalacze (bez zatwierdzania)"""
+    for shard in shards:
+        if shard is conn:
+            continue
+        cursor = shard.cursor()
+        rebuild_derived_tables(cursor)
+        create_triggers(cursor)
+        intern_tags(conn.cursor(), (row[0] for row in shard.execute('SELECT DISTINCT tag FROM tags')))
+
+
+def _commit_shards(conn: sqlite3.Connection, shards: List[sqlite3.Connection]):
+    """Zatwierdza i zamyka shardy - tuż przed zatwierdzeniem bazy głównej, gdy cała praca jest już wykonana"""
+    for shard in shards:
+        if shard is not conn:
+            shard.commit()
+            shard.close()
+
+
+def _drop_indexes(cursor: sqlite3.Cursor) -> List[str]:
+    """Usuwa indeksy pomocnicze (zbudowanie ich po załadowaniu danych jest tańsze) i zwraca ich definicje"""
+    cursor.execute("SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL")
+    indexes = cursor.fetchall()
+    for name, _ in indexes:
+        cursor.execute(f'DROP INDEX {name}')
+    return [sql for _, sql in indexes]
+
+
+@contextmanager
+def bulk_replace(conn: sqlite3.Connection, db_path: str, count: Optional[int] = None,
+                 rebuild: bool = True) -> Iterator[List[sqlite3.Connection]]:
+    """Masowa wymiana danych w jednej transakcji bez wyzwalaczy; zwraca połączenia shardów, przy rebuild=False tabele pochodne odtwarza wywołujący"""
+    cursor = conn.cursor()
+    shards: List[sqlite3.Connection] = []
     try:
-        with open('ratings.csv', 'r', encoding='utf-8') as file:
-            reader = csv.reader(file)
-            next(reader)
-            for row in reader:
-                if len(row) >= 4:
-                    cursor.execute(
-                        'INSERT OR IGNORE INTO ratings (userId, movieId, rating, timestamp) VALUES (?, ?, ?, ?)',
-                        (int(row[0]), int(row[1]), float(row[2]), int(row[3]))
-                    )
-    except FileNotFoundError:
-        print("Plik ratings.csv nie został znaleziony")
-
-    # Wczytaj tagi
+        # Jawna transakcja przed DDL - inaczej sqlite3 zatwierdziłby usunięcie wyzwalaczy od razu
+        cursor.execute('BEGIN IMMEDIATE')
+        drop_triggers(cursor)
+        indexes = _drop_indexes(cursor)
+        shards = _open_shards(conn, db_path, count or get_shard_count(cursor))
+        yield shards
+        _finish_shards(conn, shards)
+        if rebuild:
+            rebuild_derived_tables(cursor)
+        else:
+            mark_bulk_replaced(cursor)
+        for sql in indexes:
+            cursor.execute(sql)
+        create_triggers(cursor)
+        _commit_shards(conn, shards)
+        conn.commit()
+    except Exception:
+        _rollback_shards(conn, shards)
+        conn.rollback()
+        raise
+
+
+def _remove_database_files(path: str):
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def reshard(count: int, db_path: str = 'movies.db'):
+    """Przenosi oceny i tagi do podziału na count plików według userId (1 - z powrotem do bazy głównej)"""
+    if count < 1:
+        raise ValueError("Liczba shardów musi być dodatnia")
+    create_database(db_path)
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    new_paths = [path for path in shard_paths(db_path, count) if path != db_path]
     try:
-        with open('tags.csv', 'r', encoding='utf-8') as file:
-            reader = csv.reader(file)
-            next(reader)
-            for row in reader:
-                if len(row) >= 4:
-                    cursor.execute(
-                        'INSERT OR IGNORE INTO tags (userId, movieId, tag, timestamp) VALUES (?, ?, ?, ?)',
-                        (int(row[0]), int(row[1]), row[2], int(row[3]))
-                    )
-    except FileNotFoundError:
-        print("Plik tags.csv nie został znaleziony")
+        old_count = get_shard_count(cursor)
+        if count == old_count:
+            return
+        old_paths = shard_paths(db_path, old_count)
+        for path in new_paths:
+            _remove_database_files(path)
 
-    conn.commit()
-    conn.close()
+        with bulk_replace(conn, db_path, count) as shards:
+            for path in old_paths:
+                source = conn if path == db_path else sqlite3.connect(path)
+                for table in SHARDED_TABLES:
+                    columns, _ = SOURCE_TABLES[table]
+                    names = ', '.join(columns)
+                    query = f'INSERT OR IGNORE INTO {table} ({names}) VALUES ({", ".join("?" for _ in columns)})'
+                    rows = source.execute(f'SELECT {names} FROM {table}')
+                    while True:
+                        batch = rows.fetchmany(BATCH_SIZE)
+                        if not batch:
+                            break
+                        for index, routed in _route_rows(batch, count).items():
+                            shards[index].executemany(query, routed)
+                if source is not conn:
+                    source.close()
+
+            if old_count == 1:
+                for table in SHARDED_TABLES:
+                    cursor.execute(f'DELETE FROM {table}')
+            cursor.execute("INSERT OR REPLACE INTO settings (name, value) VALUES ('shards', ?)", (str(count),))
+    except Exception:
+        for path in new_paths:
+            _remove_database_files(path)
+        raise
+    finally:
+        conn.close()
+
+    for path in old_paths:
+        if path != db_path:
+            _remove_database_files(path)
+
+
+def _optional_str(value: str) -> Optional[str]:
+    """Zamienia pusty napis na NULL"""
+    return value if value != '' else None
+
+
+# Tabela, plik CSV, zapytanie INSERT, konwertery kolumn oraz informacja, czy plik można
+# bezpiecznie ciąć na zakresy bajtów (same liczby, brak pól w cudzysłowach)
+CSV_TABLES = [
+    ('movies', 'movies.csv',
+     'INSERT OR IGNORE INTO movies (movieId, title, genres) VALUES (?, ?, ?)',
+     (int, str, str), False),
+    ('links', 'links.csv',
+     'INSERT OR IGNORE INTO links (movieId, imdbId, tmdbId) VALUES (?, ?, ?)',
+     (int, str, _optional_str), True),
+    ('ratings', 'ratings.csv',
+     'INSERT OR IGNORE INTO ratings (userId, movieId, rating, timestamp) VALUES (?, ?, ?, ?)',
+     (int, int, float, int), True),
+    ('tags', 'tags.csv',
+     'INSERT OR IGNORE INTO tags (userId, movieId, tag, timestamp) VALUES (?, ?, ?, ?)',
+     (int, int, str, int), False),
+]
+
+BATCH_SIZE = 10000
+CHUNK_SIZE = 4 * 1024 * 1024
+MAX_PENDING_CHUNKS = 4
+
+
+def _convert_rows(rows: Iterable[List[str]], converters: Tuple[Callable, ...]) -> Iterator[tuple]:
+    """Konwertuje wiersze CSV na krotki z typami kolumn tabeli"""
+    width = len(converters)
+    for row in rows:
+        if len(row) >= width:
+            yield tuple(convert(value) for convert, value in zip(converters, row))
+
+
+def _csv_chunks(path: str, chunk_size: int = CHUNK_SIZE) -> Iterator[Tuple[int, int]]:
+    """Dzieli plik CSV (bez nagłówka) na zakresy bajtów kończące się na końcu wiersza"""
+    size = os.path.getsize(path)
+    with open(path, 'rb') as file:
+        file.readline()
+        start = file.tell()
+        while start < size:
+            file.seek(min(start + chunk_size, size))
+            file.readline()
+            end = file.tell()
+            yield start, end
+            start = end
+
+
+def _parse_chunk(path: str, start: int, end: int, converters: Tuple[Callable, ...]) -> List[tuple]:
+    """Parsuje jeden zakres bajtów pliku CSV (uruchamiane w procesie roboczym)"""
+    with open(path, 'rb') as file:
+        file.seek(start)
+        data = file.read(end - start).decode('utf-8')
+    return list(_convert_rows(csv.reader(data.splitlines()), converters))
+
+
+def _read_batches(path: str, converters: Tuple[Callable, ...],
+                  batch_size: int = BATCH_SIZE) -> Iterator[List[tuple]]:
+    """Strumieniowo czyta plik CSV i zwraca paczki przekonwertowanych wierszy"""
+    with open(path, 'r', encoding='utf-8', newline='') as file:
+        reader = csv.reader(file)
+        next(reader, None)  # Pomijamy nagłówek
+        rows = _convert_rows(reader, converters)
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                return
+            yield batch
+
+
+def _parallel_batches(path: str, converters: Tuple[Callable, ...],
+                      workers: int) -> Iterator[List[tuple]]:
+    """Parsuje zakresy pliku w puli procesów (najwyżej MAX_PENDING_CHUNKS naraz) i zwraca paczki w kolejności pliku"""
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for start, end in _csv_chunks(path):
+            pending.append(pool.submit(_parse_chunk, path, start, end, converters))
+            if len(pending) >= MAX_PENDING_CHUNKS:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def csv_batches(path: str, converters: Tuple[Callable, ...], chunkable: bool = False,
+                workers: Optional[int] = None) -> Iterator[List[tuple]]:
+    """Zwraca paczki wierszy z pliku CSV, dla dużych plików parsowane równolegle"""
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if chunkable and workers > 1 and os.path.getsize(path) > CHUNK_SIZE:
+        return _parallel_batches(path, converters, workers)
+    return _read_batches(path, converters)
+
+
+def load_data_from_csv(workers: Optional[int] = None, db_path: str = 'movies.db'):
+    """Ładuje dane z plików CSV do bazy danych"""
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    try:
+        with bulk_replace(conn, db_path) as shards:
+            for table, path, query, converters, chunkable in CSV_TABLES:
+                try:
+                    for batch in csv_batches(path, converters, chunkable, workers):
+                        if table not in SHARDED_TABLES:
+                            cursor.executemany(query, batch)
+                            continue
+                        for index, routed in _route_rows(batch, len(shards)).items():
+                            shards[index].executemany(query, routed)
+                except FileNotFoundError:
+                    print(f"Plik {path} nie został znaleziony")
+    finally:
+        conn.close()
 
 
 if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == 'reshard':
+        reshard(int(sys.argv[2]))
+        print(f"Oceny i tagi zostały podzielone na {sys.argv[2]} plików")
+        sys.exit(0)
+    if len(sys.argv) in (2, 3) and sys.argv[1] == 'prune-changes':
+        keep = int(sys.argv[2]) if len(sys.argv) == 3 else CHANGE_LOG_RETENTION
+        main_conn = sqlite3.connect('movies.db')
+        count = get_shard_count(main_conn.cursor())
+        main_conn.close()
+        for path in ['movies.db'] + [path for path in shard_paths('movies.db', count) if path != 'movies.db']:
+            conn = sqlite3.connect(path)
+            print(f"{path}: usunięto {prune_change_log(conn.cursor(), keep)} wpisów dziennika zmian")
+            conn.commit()
+            conn.close()
+        sys.exit(0)
     create_database()
     load_data_from_csv()
     print("Baza danych została utworzona i wypełniona danymi!")
\ No newline at end of file
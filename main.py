@@ -1,8 +1,23 @@
-from fastapi import FastAPI, HTTPException
-from typing import List, Optional
+from fastapi import FastAPI, HTTPException, Query
+from typing import Callable, Dict, List, Literal, Optional, Set, Tuple
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+import asyncio
+import functools
+import json
+import os
+import random
 import sqlite3
+import threading
+import time
 from pydantic import BaseModel
 
+from database import get_shard_count, shard_index, shard_paths, week_start
+from maintenance import (MaintenanceError, analyze, backup_all, database_files, database_stats, incremental_vacuum,
+                         run_maintenance)
+from rating_index import RatingIndex, RatingIndexError, refresh_rating_index
+
 class Movie(BaseModel):
     movieId: int
     title: str
@@ -28,88 +43,514 @@ class Tag(BaseModel):
     tag: str
     timestamp: int
 
-app = FastAPI()
 
-def get_db_connection():
-    """Tworzy połączenie z bazą danych"""
-    conn = sqlite3.connect('movies.db')
+class RatingBucket(BaseModel):
+    start: int
+    count: int
+    average: float
+
+
+class TrendingMovie(BaseModel):
+    movieId: int
+    title: Optional[str] = None
+    count: int
+    average: float
+
+
+class TagCount(BaseModel):
+    tagId: int
+    tag: str
+    count: int
+
+
+class Change(BaseModel):
+    seq: int
+    table: str
+    op: str
+    key: list
+    payload: Optional[dict] = None
+
+
+class ChangeFeed(BaseModel):
+    changes: List[Change]
+    last_seq: int
+    generation: str
+    shards: int
+
+
+class RatingSummary(BaseModel):
+    count: int
+    average: Optional[float] = None
+
+
+class MovieDetails(BaseModel):
+    movie: Movie
+    link: Optional[Link] = None
+    ratings: RatingSummary
+    tags: List[TagCount]
+
+
+class DatabaseStats(BaseModel):
+    path: str
+    page_size: int
+    page_count: int
+    freelist_count: int
+    auto_vacuum: str
+
+
+class MaintenanceReport(BaseModel):
+    path: str
+    operation: str
+    pages_before: int
+    pages_after: int
+    freelist_before: int
+    freelist_after: int
+    seconds: float
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Uruchamia zadania okresowe aplikacji (odświeżanie indeksu ocen i konserwację bazy, jeśli są włączone)"""
+    tasks = []
+    if RATING_INDEX_REFRESH:
+        tasks.append(asyncio.create_task(refresh_rating_indexes_periodically()))
+    if MAINTENANCE_INTERVAL:
+        tasks.append(asyncio.create_task(run_maintenance_periodically()))
+    yield
+    for task in tasks:
+        task.cancel()
+
+
+app = FastAPI(lifespan=lifespan)
+
+# Aplikację można uruchamiać w wielu procesach roboczych (uvicorn main:app --workers N) na jednym pliku movies.db
+# Oceny i tagi mogą być podzielone według userId na kilka plików (python database.py reshard N)
+DB_PATH = 'movies.db'
+BUSY_TIMEOUT = 5.0
+RETRY_ATTEMPTS = 6
+RETRY_BASE_DELAY = 0.02
+RETRY_MAX_WAIT = 10.0
+# Co ile sekund przebudowywać indeks ocen (rating_index.py) dla GET /ratings/{user_id}/{movie_id};
+# None - odczyty ocen bezpośrednio z bazy
+RATING_INDEX_REFRESH: Optional[float] = None
+# Co ile sekund wykonywać rutynową konserwację bazy (maintenance.py: ANALYZE i odzyskanie
+# wolnych stron); None - tylko na żądanie przez /admin/db/*
+MAINTENANCE_INTERVAL: Optional[float] = None
+BACKUP_DIR = 'backups'
+
+_prepared: Set[Tuple[int, str]] = set()
+_table_cache: Dict[Tuple[str, str], Tuple[int, list]] = {}
+_shard_paths: Optional[List[str]] = None
+_fan_out_pool: Optional[ThreadPoolExecutor] = None
+_fan_out_lock = threading.Lock()
+_rating_indexes: Dict[str, RatingIndex] = {}
+_retry_state = threading.local()
+
+
+def get_db_connection(db_path: Optional[str] = None):
+    """Tworzy połączenie z bazą danych (domyślnie główną, opcjonalnie z plikiem shardu)"""
+    db_path = db_path or DB_PATH
+    timeout = BUSY_TIMEOUT
+    deadline = getattr(_retry_state, 'deadline', None)
+    if deadline is not None:
+        # Wewnątrz retry_on_busy czekanie na blokadę nie wychodzi poza łączny limit operacji
+        timeout = max(0.0, min(timeout, deadline - time.monotonic()))
+    conn = sqlite3.connect(db_path, timeout=timeout)
     conn.row_factory = sqlite3.Row  # Umożliwia dostęp do kolumn przez nazwy
+    if (os.getpid(), db_path) not in _prepared:
+        # Pierwsze połączenie w danym procesie (także po fork) upewnia się, że baza jest w trybie WAL
+        conn.execute('PRAGMA journal_mode=WAL')
+        _prepared.add((os.getpid(), db_path))
+    conn.execute('PRAGMA synchronous=NORMAL')
     return conn
 
 
+def get_shard_paths() -> List[str]:
+    """Zwraca pliki z ocenami i tagami; układ jest odczytywany z bazy głównej raz na proces"""
+    global _shard_paths
+    if _shard_paths is None:
+        conn = get_db_connection()
+        try:
+            _shard_paths = shard_paths(DB_PATH, get_shard_count(conn.cursor()))
+        finally:
+            conn.close()
+    return _shard_paths
+
+
+def reload_shard_config():
+    """Wymusza ponowne odczytanie układu shardów (np. po python database.py reshard N)"""
+    global _shard_paths, _fan_out_pool
+    with _fan_out_lock:
+        _shard_paths = None
+        # Pula ma tylu wątków, ile było shardów - przy następnym fan_out powstaje nowa
+        if _fan_out_pool is not None:
+            _fan_out_pool.shutdown(wait=False)
+            _fan_out_pool = None
+
+
+def user_db_path(user_id: int) -> str:
+    """Zwraca plik przechowujący oceny i tagi danego użytkownika"""
+    paths = get_shard_paths()
+    return paths[shard_index(user_id, len(paths))]
+
+
+def fan_out(func: Callable, *args) -> list:
+    """Wywołuje func(db_path, *args) dla każdego shardu - równolegle, gdy jest ich więcej niż jeden"""
+    global _fan_out_pool
+    paths = get_shard_paths()
+    if len(paths) == 1:
+        return [func(paths[0], *args)]
+    with _fan_out_lock:
+        if _fan_out_pool is None:
+            _fan_out_pool = ThreadPoolExecutor(max_workers=len(paths))
+        # Zadania są zlecane pod blokadą, żeby reload_shard_config nie zamknął puli w międzyczasie
+        results = _fan_out_pool.map(lambda path: func(path, *args), paths)
+    return list(results)
+
+
+def _shard_limit(limit: int) -> int:
+    # Przy wielu shardach każdy musi zwrócić wszystkie wiersze, bo wynik łączy się dopiero po zsumowaniu
+    return limit if len(get_shard_paths()) == 1 else -1
+
+
+def _is_busy_error(error: sqlite3.OperationalError) -> bool:
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
+
+
+def retry_on_busy(func):
+    """Ponawia operację na bazie zajętej przez inny proces, łącznie do RETRY_MAX_WAIT sekund"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if getattr(_retry_state, 'deadline', None) is not None:
+            return func(*args, **kwargs)
+        deadline = _retry_state.deadline = time.monotonic() + RETRY_MAX_WAIT
+        try:
+            for attempt in range(RETRY_ATTEMPTS):
+                try:
+                    return func(*args, **kwargs)
+                except sqlite3.OperationalError as e:
+                    remaining = deadline - time.monotonic()
+                    if not _is_busy_error(e) or attempt == RETRY_ATTEMPTS - 1 or remaining <= 0:
+                        raise
+                    time.sleep(min(remaining, RETRY_BASE_DELAY * 2 ** attempt * (1 + random.random())))
+        finally:
+            _retry_state.deadline = None
+    return wrapper
+
+
+@retry_on_busy
+def get_table_cached(table: str, db_path: Optional[str] = None) -> list:
+    """Zwraca całą tabelę, korzystając z pamięci podręcznej procesu, dopóki licznik zmian tabeli się nie zmieni"""
+    conn = get_db_connection(db_path)
+    try:
+        conn.execute('BEGIN')  # Licznik i wiersze z tego samego stanu bazy
+        version = conn.execute('SELECT version FROM change_counters WHERE tbl=?', (table,)).fetchone()[0]
+        cached = _table_cache.get((db_path or DB_PATH, table))
+        if cached and cached[0] == version:
+            return cached[1]
+        rows = [dict(row) for row in conn.execute(f'SELECT * FROM {table}')]
+        _table_cache[(db_path or DB_PATH, table)] = (version, rows)
+        return rows
+    finally:
+        conn.close()
+
+
 def get_movies_from_db():
     """Pobiera wszystkie filmy z bazy danych"""
+    return get_table_cached('movies')
+
+
+def get_movies_by_ids_from_db(movie_ids: List[int]):
+    """Pobiera filmy o podanych identyfikatorach jednym zapytaniem, w kolejności identyfikatorów"""
+    return fetch_all_rows(
+        'SELECT m.* FROM json_each(?) AS ids JOIN movies m ON m.movieId = ids.value ORDER BY ids.key',
+        (json.dumps(movie_ids),),
+    )
+
+
+def get_movie_details_from_db(movie_id: int, tag_limit: int = 10):
+    """Pobiera film wraz z linkiem, podsumowaniem ocen i najczęstszymi tagami"""
+    if len(get_shard_paths()) > 1:
+        return _get_sharded_movie_details(movie_id, tag_limit)
+    return _get_movie_details(movie_id, tag_limit)
+
+
+@retry_on_busy
+def _get_movie_details(movie_id: int, tag_limit: int):
+    """Film, link, podsumowanie ocen i tagi jednym połączeniem z bazy bez podziału na shardy"""
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM movies')
-    movies = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    return movies
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            f'''
+            {MOVIE_DETAILS_QUERY},
+                   (SELECT SUM(count) FROM rating_rollups_weekly WHERE movieId = m.movieId) AS ratingCount,
+                   (SELECT SUM(total) FROM rating_rollups_weekly WHERE movieId = m.movieId) AS ratingTotal
+            FROM movies m LEFT JOIN links l ON l.movieId = m.movieId
+            WHERE m.movieId=?
+            ''',
+            (movie_id,),
+        )
+        row = cursor.fetchone()
+        if not row:
+            return None
+        cursor.execute(MOVIE_TAG_COUNTS_QUERY + ' ORDER BY c.count DESC, v.tag LIMIT ?', (movie_id, tag_limit))
+        tags = [dict(tag) for tag in cursor.fetchall()]
+    finally:
+        conn.close()
+    return _movie_details(dict(row), row['ratingCount'] or 0, row['ratingTotal'], tags)
+
+
+def _get_sharded_movie_details(movie_id: int, tag_limit: int):
+    """Film i link z bazy głównej, podsumowanie ocen i tagi zebrane ze wszystkich shardów"""
+    row = fetch_single_row(
+        f'{MOVIE_DETAILS_QUERY} FROM movies m LEFT JOIN links l ON l.movieId = m.movieId WHERE m.movieId=?',
+        (movie_id,),
+    )
+    if not row:
+        return None
+    summaries = fan_out(lambda path: fetch_single_row(
+        'SELECT COALESCE(SUM(count), 0) AS count, SUM(total) AS total FROM rating_rollups_weekly WHERE movieId=?',
+        (movie_id,), path,
+    ))
+    count = sum(summary['count'] for summary in summaries)
+    total = sum(summary['total'] or 0 for summary in summaries)
+    return _movie_details(row, count, total, get_tag_counts(tag_limit, movie_id))
+
+
+MOVIE_DETAILS_QUERY = '''
+            SELECT m.movieId, m.title, m.genres,
+                   l.movieId AS linkMovieId, l.imdbId, l.tmdbId'''
+
+MOVIE_TAG_COUNTS_QUERY = (
+    'SELECT v.tagId, v.tag, v.normalized, c.count FROM movie_tag_counts c '
+    'JOIN tag_vocabulary v ON v.tagId = c.tagId WHERE c.movieId=?'
+)
+
+
+def _movie_details(row: dict, count: int, total: Optional[float], tags: list) -> dict:
+    return {
+        'movie': {'movieId': row['movieId'], 'title': row['title'], 'genres': row['genres']},
+        'link': None if row['linkMovieId'] is None else {
+            'movieId': row['linkMovieId'], 'imdbId': row['imdbId'], 'tmdbId': row['tmdbId'],
+        },
+        'ratings': {'count': count, 'average': total / count if count else None},
+        'tags': tags,
+    }
+
+
+def get_tag_counts(limit: int, movie_id: Optional[int] = None) -> list:
+    """Zwraca najczęstsze tagi (wszystkich filmów lub jednego) zsumowane ze wszystkich shardów"""
+    if movie_id is None:
+        query = (
+            'SELECT tagId, tag, normalized, count FROM tag_vocabulary WHERE count > 0 ORDER BY count DESC, tag LIMIT ?'
+        )
+        params = ()
+    else:
+        query = MOVIE_TAG_COUNTS_QUERY + ' ORDER BY c.count DESC, v.tag LIMIT ?'
+        params = (movie_id,)
+    results = fan_out(lambda path: fetch_all_rows(query, params + (_shard_limit(limit),), path))
+    if len(results) == 1:
+        return results[0]
+
+    counts = Counter()
+    for rows in results:
+        for row in rows:
+            counts[row['normalized']] += row['count']
+    vocabulary = {
+        row['normalized']: row for row in fetch_all_rows(
+            'SELECT tagId, tag, normalized FROM tag_vocabulary WHERE normalized IN (SELECT value FROM json_each(?))',
+            (json.dumps(list(counts)),),
+        )
+    }
+    top = sorted(counts.items(), key=lambda item: (-item[1], vocabulary[item[0]]['tag']))[:limit]
+    return [
+        {'tagId': vocabulary[normalized]['tagId'], 'tag': vocabulary[normalized]['tag'], 'count': count}
+        for normalized, count in top
+    ]
+
+
+def intern_tag(tag: str):
+    """Przy podziale na shardy dopisuje nowy tekst tagu do wspólnego słownika bazy głównej"""
+    if len(get_shard_paths()) > 1 and not fetch_single_row(
+            'SELECT 1 FROM tag_vocabulary WHERE normalized=lower(trim(?))', (tag,)):
+        execute_write(
+            'INSERT OR IGNORE INTO tag_vocabulary (tag, normalized, count) VALUES (?, lower(trim(?)), 0)',
+            (tag, tag),
+        )
+
+
+def get_change_log_state(db_path: Optional[str] = None) -> Tuple[str, int, int]:
+    """Zwraca generację danych pliku bazy, numer, do którego dziennik zmian został przycięty, i ostatni numer zmiany"""
+    settings = {
+        row['name']: row['value']
+        for row in fetch_all_rows(
+            "SELECT name, value FROM settings WHERE name IN ('generation', 'change_log_horizon') "
+            "UNION ALL SELECT 'head', COALESCE(MAX(seq), 0) FROM change_log", (), db_path,
+        )
+    }
+    horizon = int(settings.get('change_log_horizon', 0))
+    return settings.get('generation', ''), horizon, max(int(settings['head']), horizon)
+
+
+def get_changes_from_db(since: int, limit: int, db_path: Optional[str] = None):
+    """Pobiera wpisy dziennika zmian o numerze większym niż since"""
+    rows = fetch_all_rows(
+        'SELECT seq, tbl AS "table", op, key, payload FROM change_log WHERE seq > ? ORDER BY seq LIMIT ?',
+        (since, limit),
+        db_path,
+    )
+    for row in rows:
+        row['key'] = json.loads(row['key'])
+        row['payload'] = json.loads(row['payload']) if row['payload'] else None
+    return rows
+
+
+def get_rating_index(db_path: str) -> Optional[RatingIndex]:
+    """Zwraca otwarty indeks ocen pliku bazy lub None, jeśli indeks nie został jeszcze zbudowany"""
+    index = _rating_indexes.get(db_path)
+    if index is None:
+        try:
+            index = _rating_indexes[db_path] = RatingIndex(db_path)
+        except (OSError, RatingIndexError):
+            return None
+    return index
+
+
+def refresh_rating_indexes(max_age: float):
+    """Przebudowuje indeksy ocen starsze niż max_age sekund (lub nieaktualne) i przełącza się na nowe pliki"""
+    for db_path in get_shard_paths():
+        index = _rating_indexes.get(db_path)
+        refresh_rating_index(db_path, max_age, index)
+        if index is not None:
+            index.reload()
+
+
+async def refresh_rating_indexes_periodically():
+    while True:
+        try:
+            await asyncio.to_thread(refresh_rating_indexes, RATING_INDEX_REFRESH)
+        except (OSError, sqlite3.Error) as e:
+            print(f"Nie udało się odświeżyć indeksu ocen: {e}")
+        await asyncio.sleep(RATING_INDEX_REFRESH)
+
+
+def get_rating_from_db(user_id: int, movie_id: int):
+    """Pobiera ocenę - z indeksu ocen, jeśli jest włączony i aktualny, w przeciwnym razie z bazy"""
+    db_path = user_db_path(user_id)
+    index = get_rating_index(db_path) if RATING_INDEX_REFRESH else None
+    if index is not None:
+        try:
+            return index.get(user_id, movie_id)
+        except RatingIndexError:
+            pass
+    return fetch_single_row('SELECT * FROM ratings WHERE userId=? AND movieId=?', (user_id, movie_id), db_path)
 
 
 def get_links_from_db():
     """Pobiera wszystkie linki z bazy danych"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM links')
-    links = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    return links
+    return get_table_cached('links')
 
 
 def get_ratings_from_db():
     """Pobiera wszystkie oceny z bazy danych"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM ratings')
-    ratings = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    return ratings
+    return _concat(fan_out(lambda path: get_table_cached('ratings', path)))
 
 
 def get_tags_from_db():
     """Pobiera wszystkie tagi z bazy danych"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM tags')
-    tags = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    return tags
+    return _concat(fan_out(lambda path: get_table_cached('tags', path)))
 
 
-def fetch_single_row(query: str, params: tuple):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(query, params)
-    row = cursor.fetchone()
-    conn.close()
-    return dict(row) if row else None
+def _concat(results: list) -> list:
+    return results[0] if len(results) == 1 else [row for rows in results for row in rows]
 
 
-def execute_write(query: str, params: tuple) -> int:
-    conn = get_db_connection()
+@retry_on_busy
+def fetch_single_row(query: str, params: tuple, db_path: Optional[str] = None):
+    conn = get_db_connection(db_path)
+    try:
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        row = cursor.fetchone()
+        return dict(row) if row else None
+    finally:
+        conn.close()
+
+
+@retry_on_busy
+def fetch_all_rows(query: str, params: tuple, db_path: Optional[str] = None):
+    conn = get_db_connection(db_path)
+    try:
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        return [dict(row) for row in cursor.fetchall()]
+    finally:
+        conn.close()
+
+
+@retry_on_busy
+def execute_write(query: str, params: tuple, db_path: Optional[str] = None) -> int:
+    conn = get_db_connection(db_path)
+    cursor = conn.cursor()
+    try:
+        cursor.execute(query, params)
+        conn.commit()
+        return cursor.rowcount
+    finally:
+        cursor.close()
+        conn.close()
+
+
+@retry_on_busy
+def execute_returning(query: str, params: tuple, db_path: Optional[str] = None):
+    """Wykonuje zapis z klauzulą RETURNING w jednej transakcji i zwraca zapisany wiersz"""
+    conn = get_db_connection(db_path)
     cursor = conn.cursor()
-    cursor.execute(query, params)
-    conn.commit()
-    rowcount = cursor.rowcount
-    conn.close()
-    return rowcount
+    try:
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+        conn.commit()
+        return dict(rows[0]) if rows else None
+    finally:
+        # Zamknięcie kursora finalizuje instrukcję - inaczej po błędzie połączenie zamykałoby się
+        # dopiero po zwolnieniu wyjątku (i kursora) przez odśmiecacz, trzymając blokadę zapisu
+        cursor.close()
+        conn.close()
 
 
 @app.get("/movies", response_model=List[Movie])
-async def get_movies():
-    """Zwraca listę wszystkich filmów z bazy danych"""
+def get_movies(ids: Optional[str] = None):
+    """Zwraca listę wszystkich filmów lub tylko filmów o podanych identyfikatorach (?ids=1,2,3)"""
+    movie_ids = None
+    if ids is not None:
+        try:
+            movie_ids = list(dict.fromkeys(int(movie_id) for movie_id in ids.split(',') if movie_id.strip()))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Niepoprawna lista identyfikatorów")
     try:
+        if movie_ids is not None:
+            return get_movies_by_ids_from_db(movie_ids)
         movies = get_movies_from_db()
         return movies
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Błąd bazy danych: {str(e)}")
 
 
+@app.get("/movies/{movie_id}/full", response_model=MovieDetails)
+def read_movie_details(movie_id: int, tag_limit: int = Query(10, ge=1, le=1000)):
+    """Zwraca film razem z linkiem, podsumowaniem ocen i najczęstszymi tagami"""
+    details = get_movie_details_from_db(movie_id, tag_limit)
+    if not details:
+        raise HTTPException(status_code=404, detail="Film nie istnieje")
+    return details
+
+
 # ============ LINKS ENDPOINTS ============
 
 @app.get("/links", response_model=List[Link])
-async def get_links():
+def get_links():
     """Zwraca listę wszystkich linków z bazy danych"""
     try:
         links = get_links_from_db()
@@ -119,21 +560,19 @@ async def get_links():
 
 
 @app.post("/links", response_model=Link, status_code=201)
-async def create_link(link: Link):
+def create_link(link: Link):
     """Tworzy nowy link w bazie danych"""
     try:
-        execute_write(
-            'INSERT INTO links (movieId, imdbId, tmdbId) VALUES (?, ?, ?)',
+        return execute_returning(
+            'INSERT INTO links (movieId, imdbId, tmdbId) VALUES (?, ?, ?) RETURNING *',
             (link.movieId, link.imdbId, link.tmdbId),
         )
-        created = fetch_single_row('SELECT * FROM links WHERE movieId=?', (link.movieId,))
-        return created
     except sqlite3.IntegrityError as e:
         raise HTTPException(status_code=400, detail=f"Nie można utworzyć linku: {str(e)}")
 
 
 @app.get("/links/{movie_id}", response_model=Link)
-async def read_link(movie_id: int):
+def read_link(movie_id: int):
     """Zwraca link dla danego filmId"""
     link = fetch_single_row('SELECT * FROM links WHERE movieId=?', (movie_id,))
     if not link:
@@ -142,21 +581,21 @@ async def read_link(movie_id: int):
 
 
 @app.put("/links/{movie_id}", response_model=Link)
-async def update_link(movie_id: int, link: Link):
+def update_link(movie_id: int, link: Link):
     """Aktualizuje link dla danego filmId"""
     if link.movieId != movie_id:
         raise HTTPException(status_code=400, detail="Identyfikatory nie są zgodne")
-    updated = execute_write(
-        'UPDATE links SET imdbId=?, tmdbId=? WHERE movieId=?',
+    updated = execute_returning(
+        'UPDATE links SET imdbId=?, tmdbId=? WHERE movieId=? RETURNING *',
         (link.imdbId, link.tmdbId, movie_id),
     )
     if not updated:
         raise HTTPException(status_code=404, detail="Link nie istnieje")
-    return fetch_single_row('SELECT * FROM links WHERE movieId=?', (movie_id,))
+    return updated
 
 
 @app.delete("/links/{movie_id}")
-async def delete_link(movie_id: int):
+def delete_link(movie_id: int):
     """Usuwa link dla danego filmId"""
     deleted = execute_write('DELETE FROM links WHERE movieId=?', (movie_id,))
     if not deleted:
@@ -167,7 +606,7 @@ async def delete_link(movie_id: int):
 # ============ RATINGS ENDPOINTS ============
 
 @app.get("/ratings", response_model=List[Rating])
-async def get_ratings():
+def get_ratings():
     """Zwraca listę wszystkich ocen z bazy danych"""
     try:
         ratings = get_ratings_from_db()
@@ -177,67 +616,121 @@ async def get_ratings():
 
 
 @app.post("/ratings", response_model=Rating, status_code=201)
-async def create_rating(rating: Rating):
+def create_rating(rating: Rating):
     """Tworzy nową ocenę w bazie danych"""
     try:
-        execute_write(
-            'INSERT INTO ratings (userId, movieId, rating, timestamp) VALUES (?, ?, ?, ?)',
+        return execute_returning(
+            'INSERT INTO ratings (userId, movieId, rating, timestamp) VALUES (?, ?, ?, ?) RETURNING *',
             (rating.userId, rating.movieId, rating.rating, rating.timestamp),
+            user_db_path(rating.userId),
         )
-        created = fetch_single_row(
-            'SELECT * FROM ratings WHERE userId=? AND movieId=?',
-            (rating.userId, rating.movieId),
-        )
-        return created
     except sqlite3.IntegrityError as e:
         raise HTTPException(status_code=400, detail=f"Nie można utworzyć oceny: {str(e)}")
 
 
 @app.get("/ratings/{user_id}/{movie_id}", response_model=Rating)
-async def read_rating(user_id: int, movie_id: int):
+def read_rating(user_id: int, movie_id: int):
     """Zwraca ocenę dla danego użytkownika i filmId"""
-    rating = fetch_single_row(
-        'SELECT * FROM ratings WHERE userId=? AND movieId=?',
-        (user_id, movie_id),
-    )
+    rating = get_rating_from_db(user_id, movie_id)
     if not rating:
         raise HTTPException(status_code=404, detail="Ocena nie istnieje")
     return rating
 
 
 @app.put("/ratings/{user_id}/{movie_id}", response_model=Rating)
-async def update_rating(user_id: int, movie_id: int, rating: Rating):
+def update_rating(user_id: int, movie_id: int, rating: Rating):
     """Aktualizuje ocenę dla danego użytkownika i filmId"""
     if rating.userId != user_id or rating.movieId != movie_id:
         raise HTTPException(status_code=400, detail="Identyfikatory nie są zgodne")
-    updated = execute_write(
-        'UPDATE ratings SET rating=?, timestamp=? WHERE userId=? AND movieId=?',
+    updated = execute_returning(
+        'UPDATE ratings SET rating=?, timestamp=? WHERE userId=? AND movieId=? RETURNING *',
         (rating.rating, rating.timestamp, user_id, movie_id),
+        user_db_path(user_id),
     )
     if not updated:
         raise HTTPException(status_code=404, detail="Ocena nie istnieje")
-    return fetch_single_row(
-        'SELECT * FROM ratings WHERE userId=? AND movieId=?',
-        (user_id, movie_id),
-    )
+    return updated
 
 
 @app.delete("/ratings/{user_id}/{movie_id}")
-async def delete_rating(user_id: int, movie_id: int):
+def delete_rating(user_id: int, movie_id: int):
     """Usuwa ocenę dla danego użytkownika i filmId"""
     deleted = execute_write(
         'DELETE FROM ratings WHERE userId=? AND movieId=?',
         (user_id, movie_id),
+        user_db_path(user_id),
     )
     if not deleted:
         raise HTTPException(status_code=404, detail="Ocena nie istnieje")
     return {"detail": "Ocena usunięta"}
 
 
+# ============ RATING TRENDS ENDPOINTS ============
+
+ROLLUP_BUCKETS = {'day': 'rating_rollups_daily', 'week': 'rating_rollups_weekly'}
+
+
+@app.get("/movies/trending", response_model=List[TrendingMovie])
+def get_trending_movies(
+    timestamp: Optional[int] = None,
+    limit: int = Query(10, ge=1, le=1000),
+):
+    """Zwraca filmy z największą liczbą ocen w tygodniu zawierającym timestamp (domyślnie bieżącym)"""
+    bucket = week_start(int(time.time()) if timestamp is None else timestamp)
+    results = fan_out(lambda path: fetch_all_rows(
+        'SELECT movieId, count, total FROM rating_rollups_weekly '
+        'WHERE bucket=? ORDER BY count DESC, total / count DESC, movieId LIMIT ?',
+        (bucket, _shard_limit(limit)),
+        path,
+    ))
+    merged: Dict[int, list] = {}
+    for rows in results:
+        for row in rows:
+            counts = merged.setdefault(row['movieId'], [0, 0.0])
+            counts[0] += row['count']
+            counts[1] += row['total']
+    top = sorted(merged.items(), key=lambda item: (-item[1][0], -item[1][1] / item[1][0], item[0]))[:limit]
+    titles = {
+        movie['movieId']: movie['title'] for movie in get_movies_by_ids_from_db([movie_id for movie_id, _ in top])
+    }
+    return [
+        {'movieId': movie_id, 'title': titles.get(movie_id), 'count': count, 'average': total / count}
+        for movie_id, (count, total) in top
+    ]
+
+
+@app.get("/movies/{movie_id}/timeline", response_model=List[RatingBucket])
+def get_movie_timeline(
+    movie_id: int,
+    bucket: Literal['day', 'week'] = 'day',
+    since: Optional[int] = None,
+    until: Optional[int] = None,
+):
+    """Zwraca liczbę i średnią ocen filmu w kolejnych dniach lub tygodniach"""
+    query = f'SELECT bucket, count, total FROM {ROLLUP_BUCKETS[bucket]} WHERE movieId=?'
+    params = [movie_id]
+    if since is not None:
+        query += ' AND bucket >= ?'
+        params.append(since)
+    if until is not None:
+        query += ' AND bucket <= ?'
+        params.append(until)
+    merged: Dict[int, list] = {}
+    for rows in fan_out(lambda path: fetch_all_rows(query, tuple(params), path)):
+        for row in rows:
+            counts = merged.setdefault(row['bucket'], [0, 0.0])
+            counts[0] += row['count']
+            counts[1] += row['total']
+    return [
+        {'start': start, 'count': count, 'average': total / count}
+        for start, (count, total) in sorted(merged.items())
+    ]
+
+
 # ============ TAGS ENDPOINTS ============
 
 @app.get("/tags", response_model=List[Tag])
-async def get_tags():
+def get_tags():
     """Zwraca listę wszystkich tagów z bazy danych"""
     try:
         tags = get_tags_from_db()
@@ -247,28 +740,26 @@ async def get_tags():
 
 
 @app.post("/tags", response_model=Tag, status_code=201)
-async def create_tag(tag: Tag):
+def create_tag(tag: Tag):
     """Tworzy nowy tag w bazie danych"""
     try:
-        execute_write(
-            'INSERT INTO tags (userId, movieId, tag, timestamp) VALUES (?, ?, ?, ?)',
+        intern_tag(tag.tag)
+        return execute_returning(
+            'INSERT INTO tags (userId, movieId, tag, timestamp) VALUES (?, ?, ?, ?) RETURNING *',
             (tag.userId, tag.movieId, tag.tag, tag.timestamp),
+            user_db_path(tag.userId),
         )
-        created = fetch_single_row(
-            'SELECT * FROM tags WHERE userId=? AND movieId=? AND tag=?',
-            (tag.userId, tag.movieId, tag.tag),
-        )
-        return created
     except sqlite3.IntegrityError as e:
         raise HTTPException(status_code=400, detail=f"Nie można utworzyć tagu: {str(e)}")
 
 
 @app.get("/tags/{user_id}/{movie_id}/{tag_name}", response_model=Tag)
-async def read_tag(user_id: int, movie_id: int, tag_name: str):
+def read_tag(user_id: int, movie_id: int, tag_name: str):
     """Zwraca tag dla danego użytkownika, filmId i nazwy tagu"""
     tag = fetch_single_row(
         'SELECT * FROM tags WHERE userId=? AND movieId=? AND tag=?',
         (user_id, movie_id, tag_name),
+        user_db_path(user_id),
     )
     if not tag:
         raise HTTPException(status_code=404, detail="Tag nie istnieje")
@@ -276,48 +767,57 @@ async def read_tag(user_id: int, movie_id: int, tag_name: str):
 
 
 @app.put("/tags/{user_id}/{movie_id}/{tag_name}", response_model=Tag)
-async def update_tag(user_id: int, movie_id: int, tag_name: str, tag: Tag):
+def update_tag(user_id: int, movie_id: int, tag_name: str, tag: Tag):
     """Aktualizuje tag dla danego użytkownika, filmId i nazwy tagu"""
     if tag.userId != user_id or tag.movieId != movie_id or tag.tag != tag_name:
         raise HTTPException(status_code=400, detail="Identyfikatory nie są zgodne")
-    updated = execute_write(
-        'UPDATE tags SET timestamp=? WHERE userId=? AND movieId=? AND tag=?',
+    updated = execute_returning(
+        'UPDATE tags SET timestamp=? WHERE userId=? AND movieId=? AND tag=? RETURNING *',
         (tag.timestamp, user_id, movie_id, tag_name),
+        user_db_path(user_id),
     )
     if not updated:
         raise HTTPException(status_code=404, detail="Tag nie istnieje")
-    return fetch_single_row(
-        'SELECT * FROM tags WHERE userId=? AND movieId=? AND tag=?',
-        (user_id, movie_id, tag_name),
-    )
+    return updated
 
 
 @app.delete("/tags/{user_id}/{movie_id}/{tag_name}")
-async def delete_tag(user_id: int, movie_id: int, tag_name: str):
+def delete_tag(user_id: int, movie_id: int, tag_name: str):
     """Usuwa tag dla danego użytkownika, filmId i nazwy tagu"""
     deleted = execute_write(
         'DELETE FROM tags WHERE userId=? AND movieId=? AND tag=?',
         (user_id, movie_id, tag_name),
+        user_db_path(user_id),
     )
     if not deleted:
         raise HTTPException(status_code=404, detail="Tag nie istnieje")
     return {"detail": "Tag usunięty"}
 
+
+@app.get("/tags/popular", response_model=List[TagCount])
+def get_popular_tags(limit: int = Query(10, ge=1, le=1000)):
+    """Zwraca najczęściej używane tagi na podstawie liczników słownika tagów"""
+    return get_tag_counts(limit)
+
+
+@app.get("/movies/{movie_id}/tags/top", response_model=List[TagCount])
+def get_movie_top_tags(movie_id: int, limit: int = Query(10, ge=1, le=1000)):
+    """Zwraca najczęstsze tagi danego filmu"""
+    return get_tag_counts(limit, movie_id)
+
 @app.post("/movies", response_model=Movie, status_code=201)
-async def create_movie(movie: Movie):
+def create_movie(movie: Movie):
     try:
-        execute_write(
-            'INSERT INTO movies (movieId, title, genres) VALUES (?, ?, ?)',
+        return execute_returning(
+            'INSERT INTO movies (movieId, title, genres) VALUES (?, ?, ?) RETURNING *',
             (movie.movieId, movie.title, movie.genres),
         )
-        created = fetch_single_row('SELECT * FROM movies WHERE movieId=?', (movie.movieId,))
-        return created
     except sqlite3.IntegrityError as e:
         raise HTTPException(status_code=400, detail=f"Nie można utworzyć filmu: {str(e)}")
 
 
 @app.get("/movies/{movie_id}", response_model=Movie)
-async def read_movie(movie_id: int):
+def read_movie(movie_id: int):
     movie = fetch_single_row('SELECT * FROM movies WHERE movieId=?', (movie_id,))
     if not movie:
         raise HTTPException(status_code=404, detail="Film nie istnieje")
@@ -325,23 +825,114 @@ async def read_movie(movie_id: int):
 
 
 @app.put("/movies/{movie_id}", response_model=Movie)
-async def update_movie(movie_id: int, movie: Movie):
+def update_movie(movie_id: int, movie: Movie):
     if movie.movieId != movie_id:
         raise HTTPException(status_code=400, detail="Identyfikatory nie są zgodne")
-    updated = execute_write(
-        'UPDATE movies SET title=?, genres=? WHERE movieId=?',
+    updated = execute_returning(
+        'UPDATE movies SET title=?, genres=? WHERE movieId=? RETURNING *',
         (movie.title, movie.genres, movie_id),
     )
     if not updated:
         raise HTTPException(status_code=404, detail="Film nie istnieje")
-    return fetch_single_row('SELECT * FROM movies WHERE movieId=?', (movie_id,))
+    return updated
 
 
 @app.delete("/movies/{movie_id}")
-async def delete_movie(movie_id: int):
+def delete_movie(movie_id: int):
     deleted = execute_write('DELETE FROM movies WHERE movieId=?', (movie_id,))
     if not deleted:
         raise HTTPException(status_code=404, detail="Film nie istnieje")
     return {"detail": "Film usunięty"}
 
 
+# ============ CHANGES ENDPOINTS ============
+
+CHANGES_POLL_INTERVAL = 0.1
+
+
+@app.get("/changes", response_model=ChangeFeed)
+async def get_changes(
+    since: int = 0,
+    limit: int = Query(1000, ge=1, le=10000),
+    wait: float = Query(0, ge=0, le=30),
+    shard: Optional[int] = None,
+):
+    """Zwraca zmiany w tabelach o numerze większym niż since (przy wait > 0 czeka na nie do wait sekund)"""
+    db_path = None
+    paths = await asyncio.to_thread(get_shard_paths)
+    if shard is not None:
+        if not 0 <= shard < len(paths):
+            raise HTTPException(status_code=404, detail="Shard nie istnieje")
+        db_path = paths[shard]
+    generation, horizon, head = await asyncio.to_thread(get_change_log_state, db_path)
+    if since < horizon:
+        raise HTTPException(
+            status_code=410,
+            detail={
+                "message": "Zmiany od podanego numeru zostały usunięte z dziennika - wymagana pełna synchronizacja",
+                "horizon": horizon,
+                "last_seq": head,
+            },
+        )
+    deadline = time.monotonic() + wait
+    changes = await asyncio.to_thread(get_changes_from_db, since, limit, db_path)
+    while not changes and time.monotonic() < deadline:
+        await asyncio.sleep(CHANGES_POLL_INTERVAL)
+        changes = await asyncio.to_thread(get_changes_from_db, since, limit, db_path)
+    return {
+        "changes": changes,
+        "last_seq": changes[-1]['seq'] if changes else since,
+        "generation": generation,
+        "shards": len(paths),
+    }
+
+
+# ============ MAINTENANCE ENDPOINTS ============
+
+async def run_maintenance_periodically():
+    while True:
+        await asyncio.sleep(MAINTENANCE_INTERVAL)
+        try:
+            for report in await asyncio.to_thread(run_maintenance, DB_PATH):
+                print(f"Konserwacja bazy: {report}")
+        except (OSError, sqlite3.Error, MaintenanceError) as e:
+            print(f"Nie udało się wykonać konserwacji bazy: {e}")
+
+
+async def _maintenance(func: Callable, *args) -> list:
+    """Wykonuje operację konserwacji w osobnym wątku, nie blokując obsługi innych żądań"""
+    try:
+        return await asyncio.to_thread(func, *args)
+    except MaintenanceError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except sqlite3.Error as e:
+        raise HTTPException(status_code=500, detail=f"Błąd bazy danych: {str(e)}")
+
+
+@app.get("/admin/db/stats", response_model=List[DatabaseStats])
+async def get_database_stats():
+    """Zwraca liczbę stron, wolnych stron i tryb auto_vacuum bazy głównej i shardów"""
+    return await _maintenance(lambda: [database_stats(path) for path in database_files(DB_PATH)])
+
+
+@app.post("/admin/db/analyze", response_model=List[MaintenanceReport])
+async def analyze_database(full: bool = False):
+    """Odświeża statystyki planisty zapytań (full=true - dokładne, bez ograniczenia analysis_limit)"""
+    return await _maintenance(lambda: [analyze(path, full) for path in database_files(DB_PATH)])
+
+
+@app.post("/admin/db/vacuum", response_model=List[MaintenanceReport])
+async def vacuum_database(max_pages: int = Query(0, ge=0), truncate_wal: bool = False):
+    """Oddaje wolne strony plików bazy małymi krokami (max_pages=0 - wszystkie)"""
+    return await _maintenance(
+        lambda: [incremental_vacuum(path, max_pages, truncate_wal=truncate_wal) for path in database_files(DB_PATH)]
+    )
+
+
+@app.post("/admin/db/backup", response_model=List[MaintenanceReport], status_code=201)
+async def backup_database():
+    """Tworzy kopię zapasową bazy głównej i shardów w katalogu BACKUP_DIR"""
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(DB_PATH))[0]
+    target = os.path.join(BACKUP_DIR, f'{stem}-{time.strftime("%Y%m%d-%H%M%S")}.db')
+    return await _maintenance(backup_all, DB_PATH, target)
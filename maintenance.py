@@ -0,0 +1,212 @@
+"""Konserwacja plików bazy danych: statystyki planisty, odzyskiwanie wolnych stron i kopie zapasowe.
+
+Użycie: python maintenance.py stats|analyze|vacuum|enable-incremental|backup <plik docelowy>
+"""
+import os
+import sqlite3
+import sys
+import time
+from typing import Callable, Dict, List
+
+from database import get_shard_count, prune_change_log, shard_paths
+
+
+AUTO_VACUUM_MODES = {0: 'none', 1: 'full', 2: 'incremental'}
+VACUUM_STEP_PAGES = 256
+BACKUP_STEP_PAGES = 256
+BACKUP_MAX_RESTARTS = 3
+ANALYSIS_LIMIT = 1000
+BUSY_TIMEOUT = 5.0
+
+
+class MaintenanceError(Exception):
+    """Operacja konserwacji nie może zostać wykonana na danej bazie"""
+
+
+class _BackupRestarted(Exception):
+    """Kopia krokowa zaczynała się od nowa zbyt wiele razy"""
+
+
+def database_files(db_path: str = 'movies.db') -> List[str]:
+    """Zwraca bazę główną i pliki shardów ocen i tagów"""
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT)
+    try:
+        paths = shard_paths(db_path, get_shard_count(conn.cursor()))
+    finally:
+        conn.close()
+    return [db_path] + [path for path in paths if path != db_path]
+
+
+def _stats(conn: sqlite3.Connection) -> Dict[str, int]:
+    return {
+        'page_size': conn.execute('PRAGMA page_size').fetchone()[0],
+        'page_count': conn.execute('PRAGMA page_count').fetchone()[0],
+        'freelist_count': conn.execute('PRAGMA freelist_count').fetchone()[0],
+    }
+
+
+def database_stats(db_path: str) -> dict:
+    """Zwraca rozmiar strony, liczbę stron, liczbę wolnych stron i tryb auto_vacuum pliku bazy"""
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT)
+    try:
+        stats = _stats(conn)
+        stats['auto_vacuum'] = AUTO_VACUUM_MODES[conn.execute('PRAGMA auto_vacuum').fetchone()[0]]
+        return {'path': db_path, **stats}
+    finally:
+        conn.close()
+
+
+def _measured(operation: str, db_path: str, work: Callable[[sqlite3.Connection], None]) -> dict:
+    """Wykonuje operację na pliku bazy i zwraca raport ze stanem stron przed i po niej"""
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT, isolation_level=None)
+    try:
+        before = _stats(conn)
+        started = time.perf_counter()
+        work(conn)
+        seconds = time.perf_counter() - started
+        after = _stats(conn)
+    finally:
+        conn.close()
+    return {
+        'path': db_path,
+        'operation': operation,
+        'pages_before': before['page_count'],
+        'pages_after': after['page_count'],
+        'freelist_before': before['freelist_count'],
+        'freelist_after': after['freelist_count'],
+        'seconds': round(seconds, 6),
+    }
+
+
+def analyze(db_path: str, full: bool = False) -> dict:
+    """Odświeża statystyki planisty zapytań (ANALYZE, domyślnie z ograniczeniem ANALYSIS_LIMIT wierszy)"""
+    def work(conn):
+        conn.execute(f'PRAGMA analysis_limit={0 if full else ANALYSIS_LIMIT}')
+        conn.execute('ANALYZE')
+        conn.execute('PRAGMA optimize')
+    return _measured('analyze', db_path, work)
+
+
+def incremental_vacuum(db_path: str, max_pages: int = 0, step: int = VACUUM_STEP_PAGES,
+                       truncate_wal: bool = False) -> dict:
+    """Zwalnia wolne strony z końca pliku po step stron na transakcję (max_pages=0 - wszystkie)"""
+    def work(conn):
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            raise MaintenanceError(
+                f"Baza {db_path} nie jest w trybie auto_vacuum=INCREMENTAL - "
+                "uruchom python maintenance.py enable-incremental"
+            )
+        released = 0
+        while not max_pages or released < max_pages:
+            free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+            if not free:
+                break
+            pages = min(step, free, max_pages - released) if max_pages else min(step, free)
+            # executescript wykonuje polecenie do końca - execute zwolniłby tylko jedną stronę
+            conn.executescript(f'BEGIN IMMEDIATE; PRAGMA incremental_vacuum({pages}); COMMIT;')
+            released += pages
+        conn.execute(f'PRAGMA wal_checkpoint({"TRUNCATE" if truncate_wal else "PASSIVE"})')
+    return _measured('vacuum', db_path, work)
+
+
+def enable_incremental_vacuum(db_path: str) -> dict:
+    """Jednorazowo przełącza istniejącą bazę w tryb auto_vacuum=INCREMENTAL (pełne VACUUM blokujące zapisy)"""
+    def work(conn):
+        conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        conn.execute('VACUUM')
+    return _measured('enable-incremental', db_path, work)
+
+
+def backup(db_path: str, target: str, step: int = BACKUP_STEP_PAGES,
+           max_restarts: int = BACKUP_MAX_RESTARTS) -> dict:
+    """Kopiuje bazę przez API kopii zapasowych SQLite po step stron na krok"""
+    temp_path = f'{target}.{os.getpid()}.tmp'
+
+    def work(conn):
+        restarts, previous = 0, None
+
+        def progress(status, remaining, total):
+            nonlocal restarts, previous
+            if status != sqlite3.SQLITE_OK:
+                return
+            if previous is not None and remaining >= previous:  # Krok nie posunął kopii - zaczęła się od nowa
+                restarts += 1
+                if restarts > max_restarts:
+                    raise _BackupRestarted()
+            previous = remaining
+
+        destination = sqlite3.connect(temp_path)
+        try:
+            conn.backup(destination, pages=step, progress=progress, sleep=0.01)
+        except _BackupRestarted:
+            destination.close()
+            os.remove(temp_path)
+            conn.execute('VACUUM INTO ?', (temp_path,))
+        finally:
+            destination.close()
+        os.replace(temp_path, target)
+
+    try:
+        return _measured('backup', db_path, work)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def backup_all(db_path: str, target: str, step: int = BACKUP_STEP_PAGES) -> List[dict]:
+    """Kopiuje bazę główną i shardy; pliki shardów kopii są nazwane jak shardy bazy docelowej"""
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT)
+    try:
+        count = get_shard_count(conn.cursor())
+    finally:
+        conn.close()
+    reports = [backup(db_path, target, step)]
+    if count > 1:
+        for source, destination in zip(shard_paths(db_path, count), shard_paths(target, count)):
+            reports.append(backup(source, destination, step))
+    return reports
+
+
+def prune_changes(db_path: str) -> dict:
+    """Przycina dziennik zmian do ostatnich CHANGE_LOG_RETENTION wpisów"""
+    def work(conn):
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            prune_change_log(conn.cursor())
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+    return _measured('prune-changes', db_path, work)
+
+
+def run_maintenance(db_path: str = 'movies.db') -> List[dict]:
+    """Rutynowa konserwacja wszystkich plików bazy: przycięcie dziennika, statystyki i wolne strony"""
+    reports = []
+    for path in database_files(db_path):
+        reports.append(prune_changes(path))
+        reports.append(analyze(path))
+        if database_stats(path)['auto_vacuum'] == 'incremental':
+            reports.append(incremental_vacuum(path))
+    return reports
+
+
+if __name__ == "__main__":
+    commands = ('stats', 'analyze', 'vacuum', 'enable-incremental', 'backup')
+    if len(sys.argv) < 2 or sys.argv[1] not in commands or (sys.argv[1] == 'backup') != (len(sys.argv) == 3):
+        print("Użycie: python maintenance.py stats|analyze|vacuum|enable-incremental|backup <plik docelowy>")
+        sys.exit(1)
+    command = sys.argv[1]
+    if command == 'backup':
+        results = backup_all('movies.db', sys.argv[2])
+    else:
+        operation = {
+            'stats': database_stats,
+            'analyze': analyze,
+            'vacuum': incremental_vacuum,
+            'enable-incremental': enable_incremental_vacuum,
+        }[command]
+        results = [operation(path) for path in database_files()]
+    for result in results:
+        print(result)
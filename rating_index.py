@@ -0,0 +1,250 @@
+"""Indeks ocen do szybkich odczytów punktowych (userId, movieId) -> (rating, timestamp).
+
+Użycie: python rating_index.py build
+"""
+import json
+import mmap
+import os
+import sqlite3
+import struct
+import sys
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from database import get_change_log_horizon, get_shard_count, shard_paths
+
+
+MAGIC = b'MOVRIDX1'
+HEADER = struct.Struct('<8sQQ16s')  # magic, liczba rekordów, ostatni seq dziennika, generacja
+RECORD = struct.Struct('<qqdq')  # userId, movieId, rating, timestamp
+KEY = struct.Struct('<qq')
+LOCK_TIMEOUT = 600.0
+
+
+class RatingIndexError(Exception):
+    """Indeks nie odpowiada zawartości bazy i wymaga przebudowania"""
+
+
+def index_path(db_path: str) -> str:
+    """Zwraca ścieżkę pliku indeksu ocen dla pliku bazy (lub shardu)"""
+    return os.path.splitext(db_path)[0] + '.ratings.idx'
+
+
+def _generation(conn: sqlite3.Connection) -> str:
+    row = conn.execute("SELECT value FROM settings WHERE name = 'generation'").fetchone()
+    return row[0] if row else ''
+
+
+def build_rating_index(db_path: str = 'movies.db') -> int:
+    """Buduje indeks ocen z tabeli ratings i atomowo podmienia plik indeksu; zwraca liczbę rekordów"""
+    path = index_path(db_path)
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute('BEGIN')  # Wiersze, numer dziennika i generacja z tego samego stanu bazy
+        last_seq = conn.execute('SELECT COALESCE(MAX(seq), 0) FROM change_log').fetchone()[0]
+        generation = _generation(conn)
+        rows = conn.execute('SELECT userId, movieId, rating, timestamp FROM ratings ORDER BY userId, movieId')
+        count = 0
+        with open(temp_path, 'wb') as file:
+            file.write(HEADER.pack(MAGIC, 0, last_seq, generation.encode('ascii')))
+            while True:
+                batch = rows.fetchmany(10000)
+                if not batch:
+                    break
+                file.write(b''.join(RECORD.pack(*row) for row in batch))
+                count += len(batch)
+            file.seek(0)
+            file.write(HEADER.pack(MAGIC, count, last_seq, generation.encode('ascii')))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, path)
+        return count
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    finally:
+        conn.close()
+
+
+def _needs_rebuild(path: str, max_age: float, index: Optional['RatingIndex']) -> bool:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return True
+    if index is not None and index.stale and (stat.st_ino, stat.st_mtime_ns) == index._stat:
+        return True  # Indeks unieważniony i nikt go jeszcze nie przebudował
+    return time.time() - stat.st_mtime >= max_age
+
+
+def _release_lock(lock_path: str):
+    # Blokadę uznaną za przeterminowaną mógł w międzyczasie zastąpić inny proces - tej nie usuwamy
+    try:
+        with open(lock_path, 'rb') as file:
+            if file.read() != str(os.getpid()).encode('ascii'):
+                return
+        os.remove(lock_path)
+    except OSError:
+        pass
+
+
+def refresh_rating_index(db_path: str, max_age: float, index: Optional['RatingIndex'] = None) -> bool:
+    """Przebudowuje indeks starszy niż max_age sekund (lub unieważniony index); zwraca True po przebudowaniu"""
+    path = index_path(db_path)
+    if not _needs_rebuild(path, max_age, index):
+        return False
+    lock_path = path + '.lock'
+    try:
+        fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        try:
+            if time.time() - os.path.getmtime(lock_path) >= LOCK_TIMEOUT:
+                os.remove(lock_path)
+        except OSError:
+            pass
+        return False  # Indeks przebudowuje inny proces
+    try:
+        os.write(fd, str(os.getpid()).encode('ascii'))
+        os.close(fd)
+        if not _needs_rebuild(path, max_age, index):
+            return False
+        build_rating_index(db_path)
+        return True
+    finally:
+        _release_lock(lock_path)
+
+
+class RatingIndex:
+    """Odczyty ocen z indeksu mapowanego do pamięci z nakładką zmian z dziennika"""
+
+    def __init__(self, db_path: str = 'movies.db'):
+        self.db_path = db_path
+        self.path = index_path(db_path)
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid = None
+        self._file = None
+        self._map: Optional[mmap.mmap] = None
+        self._stat: Optional[Tuple[int, int]] = None
+        self._open()
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._pid != os.getpid():  # Połączenia SQLite nie mogą przechodzić przez fork
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+            self._pid = os.getpid()
+        return self._conn
+
+    def _open(self):
+        file = open(self.path, 'rb')
+        try:
+            stat = os.fstat(file.fileno())
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            file.close()
+            raise
+        magic, count, last_seq, generation = HEADER.unpack_from(mapped)
+        if magic != MAGIC or len(mapped) != HEADER.size + count * RECORD.size:
+            mapped.close()
+            file.close()
+            raise RatingIndexError(f"Uszkodzony plik indeksu ocen: {self.path}")
+        self._close_map()
+        self._file, self._map, self._stat = file, mapped, (stat.st_ino, stat.st_mtime_ns)
+        self.count = count
+        self.generation = generation.rstrip(b'\0').decode('ascii')
+        self.last_seq = self._seq = last_seq
+        self._overlay: Dict[Tuple[int, int], Optional[Tuple[float, int]]] = {}
+        self._data_version = None
+        self.stale = False
+
+    def _close_map(self):
+        if self._map is not None:
+            self._map.close()
+            self._file.close()
+            self._map = self._file = None
+
+    def close(self):
+        """Zwalnia mapowanie pliku i połączenie z bazą"""
+        with self._lock:
+            self._close_map()
+            if self._conn is not None and self._pid == os.getpid():
+                self._conn.close()
+            self._conn = self._pid = None
+
+    def reload(self) -> bool:
+        """Przełącza się na nowy plik indeksu, jeśli został przebudowany; zwraca True po przełączeniu"""
+        stat = os.stat(self.path)
+        if (stat.st_ino, stat.st_mtime_ns) == self._stat:
+            return False
+        with self._lock:
+            self._open()
+        return True
+
+    def _catch_up(self):
+        conn = self._connection()
+        data_version = conn.execute('PRAGMA data_version').fetchone()[0]
+        if data_version == self._data_version:
+            return
+        conn.execute('BEGIN')
+        try:
+            if _generation(conn) != self.generation:
+                self.stale = True
+            elif get_change_log_horizon(conn.cursor()) > self._seq:
+                self.stale = True  # Dziennik przycięty poza zmiany potrzebne nakładce
+            elif self._data_version is None and conn.execute(
+                    'SELECT COALESCE(MAX(seq), 0) FROM change_log').fetchone()[0] < self.last_seq:
+                self.stale = True  # Indeks zbudowany z innego pliku bazy
+            rows = conn.execute(
+                "SELECT seq, op, key, payload FROM change_log WHERE seq > ? AND tbl = 'ratings' ORDER BY seq",
+                (self._seq,),
+            )
+            for seq, op, key, payload in rows:
+                user_id, movie_id = json.loads(key)
+                if op == 'delete':
+                    self._overlay[(user_id, movie_id)] = None
+                else:
+                    row = json.loads(payload)
+                    self._overlay[(user_id, movie_id)] = (row['rating'], row['timestamp'])
+                self._seq = seq
+        finally:
+            conn.execute('COMMIT')
+        self._data_version = data_version
+
+    def _search(self, user_id: int, movie_id: int) -> Optional[Tuple[float, int]]:
+        mapped, unpack_key = self._map, KEY.unpack_from
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if unpack_key(mapped, HEADER.size + middle * RECORD.size) < (user_id, movie_id):
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count:
+            found_user, found_movie, rating, timestamp = RECORD.unpack_from(mapped, HEADER.size + low * RECORD.size)
+            if found_user == user_id and found_movie == movie_id:
+                return rating, timestamp
+        return None
+
+    def get(self, user_id: int, movie_id: int) -> Optional[dict]:
+        """Zwraca ocenę lub None, gdy nie istnieje; RatingIndexError, gdy indeks trzeba przebudować"""
+        with self._lock:
+            self._catch_up()
+            if self.stale:
+                raise RatingIndexError("Indeks ocen jest nieaktualny po masowej zmianie danych")
+            key = (user_id, movie_id)
+            found = self._overlay[key] if key in self._overlay else self._search(user_id, movie_id)
+        if found is None:
+            return None
+        return {'userId': user_id, 'movieId': movie_id, 'rating': found[0], 'timestamp': found[1]}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2 or sys.argv[1] != 'build':
+        print("Użycie: python rating_index.py build")
+        sys.exit(1)
+    conn = sqlite3.connect('movies.db')
+    paths = shard_paths('movies.db', get_shard_count(conn.cursor()))
+    conn.close()
+    for path in paths:
+        print(f"Zbudowano indeks {index_path(path)}: {build_rating_index(path)} ocen")
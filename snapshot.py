@@ -0,0 +1,280 @@
+import sqlite3
+import struct
+import sys
+import zlib
+from array import array
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+from database import (DERIVED_TABLES, ROLLUP_TABLES, SHARDED_TABLES, _route_rows, bulk_replace, create_database,
+                      get_shard_count, rebuild_rating_rollups, rebuild_tag_vocabulary, shard_paths)
+
+
+MAGIC = b'MOVSNAP2'
+SNAPSHOT_BATCH_ROWS = 65536
+
+# Kolumny zapisywane w migawce: 'q' - int64, 'd' - float64,
+# 's' - tekst kodowany słownikowo (słownik unikalnych wartości + kody uint32)
+SNAPSHOT_TABLES = [
+    ('movies', [('movieId', 'q'), ('title', 's'), ('genres', 's')]),
+    ('links', [('movieId', 'q'), ('imdbId', 's'), ('tmdbId', 's')]),
+    ('ratings', [('userId', 'q'), ('movieId', 'q'), ('rating', 'd'), ('timestamp', 'q')]),
+    ('tags', [('userId', 'q'), ('movieId', 'q'), ('tag', 's'), ('timestamp', 'q')]),
+]
+
+# Tabele pochodne zapisywane w migawce bazy bez podziału na shardy - import
+# odtwarza je zamiast przeliczać (kolejność wierszy według klucza głównego)
+DERIVED_SNAPSHOT_TABLES = [
+    ('tag_vocabulary', [('tagId', 'q'), ('tag', 's'), ('normalized', 's'), ('count', 'q')]),
+    ('movie_tag_counts', [('movieId', 'q'), ('tagId', 'q'), ('count', 'q')]),
+] + [
+    (table, [('movieId', 'q'), ('bucket', 'q'), ('count', 'q'), ('total', 'd')]) for table in ROLLUP_TABLES
+]
+SNAPSHOT_COLUMNS = dict(SNAPSHOT_TABLES + DERIVED_SNAPSHOT_TABLES)
+# Kolejność eksportu tabel WITHOUT ROWID (pozostałe według rowid)
+SNAPSHOT_ORDER = {'movie_tag_counts': 'movieId, tagId', **{table: 'movieId, bucket' for table in ROLLUP_TABLES}}
+
+
+class SnapshotError(Exception):
+    """Uszkodzona lub niezgodna migawka bazy danych"""
+
+
+def _to_le_bytes(values: array) -> bytes:
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_le_bytes(typecode: str, data: bytes) -> array:
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+def _encode_strings(values: List[Optional[str]]) -> bytes:
+    """Koduje kolumnę tekstową jako słownik unikalnych wartości i tablicę kodów"""
+    dictionary: Dict[Optional[str], int] = {}
+    codes = array('I', (dictionary.setdefault(value, len(dictionary)) for value in values))
+    lengths = array('i')
+    blob = bytearray()
+    for value in dictionary:
+        if value is None:
+            lengths.append(-1)
+        else:
+            encoded = value.encode('utf-8')
+            lengths.append(len(encoded))
+            blob += encoded
+    return (struct.pack('<I', len(dictionary)) + _to_le_bytes(lengths)
+            + bytes(blob) + _to_le_bytes(codes))
+
+
+def _decode_strings(data: bytes, count: int) -> List[Optional[str]]:
+    (size,) = struct.unpack_from('<I', data)
+    offset = 4
+    lengths = _from_le_bytes('i', data[offset:offset + 4 * size])
+    offset += 4 * size
+    dictionary: List[Optional[str]] = []
+    for length in lengths:
+        if length < 0:
+            dictionary.append(None)
+        else:
+            dictionary.append(data[offset:offset + length].decode('utf-8'))
+            offset += length
+    codes = _from_le_bytes('I', data[offset:])
+    if len(codes) != count:
+        raise SnapshotError("Niezgodna liczba wierszy w kolumnie tekstowej")
+    return [dictionary[code] for code in codes]
+
+
+def _encode_column(typecode: str, values: list) -> bytes:
+    if typecode == 's':
+        return _encode_strings(values)
+    return _to_le_bytes(array(typecode, values))
+
+
+def _decode_column(typecode: str, data: bytes, count: int) -> list:
+    if typecode == 's':
+        return _decode_strings(data, count)
+    values = _from_le_bytes(typecode, data)
+    if len(values) != count:
+        raise SnapshotError("Niezgodna liczba wierszy w kolumnie liczbowej")
+    return values.tolist()
+
+
+class _ChecksumWriter:
+    """Zapisuje dane do pliku, licząc po drodze sumę kontrolną CRC32"""
+
+    def __init__(self, file: BinaryIO):
+        self.file = file
+        self.crc = 0
+
+    def write(self, data: bytes):
+        self.crc = zlib.crc32(data, self.crc)
+        self.file.write(data)
+
+
+class _ChecksumReader:
+    """Czyta dane z pliku, licząc po drodze sumę kontrolną CRC32"""
+
+    def __init__(self, file: BinaryIO):
+        self.file = file
+        self.crc = 0
+
+    def read(self, size: int) -> bytes:
+        data = self.file.read(size)
+        if len(data) != size:
+            raise SnapshotError("Niekompletna migawka bazy danych")
+        self.crc = zlib.crc32(data, self.crc)
+        return data
+
+    def unpack(self, layout: str) -> tuple:
+        return struct.unpack(layout, self.read(struct.calcsize(layout)))
+
+
+def _source_batches(sources: List[sqlite3.Connection], query: str) -> Iterator[List[tuple]]:
+    """Zwraca wiersze kolejnych plików bazy partiami po SNAPSHOT_BATCH_ROWS"""
+    for source in sources:
+        rows = source.execute(query)
+        while True:
+            batch = rows.fetchmany(SNAPSHOT_BATCH_ROWS)
+            if not batch:
+                break
+            yield batch
+
+
+def export_snapshot(path: str, db_path: str = 'movies.db') -> Dict[str, int]:
+    """Zapisuje tabele do kolumnowej, skompresowanej migawki binarnej partiami po SNAPSHOT_BATCH_ROWS wierszy"""
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    shards: List[sqlite3.Connection] = []
+    try:
+        # Jedna transakcja odczytu na plik przez cały eksport - wszystkie tabele z tego samego stanu
+        conn.execute('BEGIN')
+        paths = shard_paths(db_path, get_shard_count(conn.cursor()))
+        for shard_path in paths:
+            if shard_path != db_path:
+                shards.append(sqlite3.connect(shard_path, isolation_level=None))
+                shards[-1].execute('BEGIN')
+                shards[-1].execute('SELECT COUNT(*) FROM sqlite_master').fetchone()  # Początek odczytu
+        tables = SNAPSHOT_TABLES + (DERIVED_SNAPSHOT_TABLES if not shards else [])
+        counts = {}
+        with open(path, 'wb') as file:
+            out = _ChecksumWriter(file)
+            out.write(MAGIC)
+            out.write(struct.pack('<I', len(tables)))
+            for table, columns in tables:
+                encoded_name = table.encode('utf-8')
+                out.write(struct.pack('<H', len(encoded_name)) + encoded_name)
+                out.write(struct.pack('<H', len(columns)))
+                names = ', '.join(name for name, _ in columns)
+                query = f'SELECT {names} FROM {table} ORDER BY {SNAPSHOT_ORDER.get(table, "rowid")}'
+                counts[table] = 0
+                for rows in _source_batches(shards if shards and table in SHARDED_TABLES else [conn], query):
+                    out.write(struct.pack('<I', len(rows)))
+                    for index, (_, typecode) in enumerate(columns):
+                        payload = zlib.compress(_encode_column(typecode, [row[index] for row in rows]))
+                        out.write(typecode.encode('ascii') + struct.pack('<Q', len(payload)))
+                        out.write(payload)
+                    counts[table] += len(rows)
+                out.write(struct.pack('<I', 0))  # Koniec tabeli
+            file.write(struct.pack('<I', out.crc))
+    finally:
+        for source in shards + [conn]:
+            source.close()
+    return {table: counts[table] for table, _ in SNAPSHOT_TABLES}
+
+
+def _read_batch(source: _ChecksumReader, table: str, row_count: int) -> List[tuple]:
+    columns = []
+    for name, typecode in SNAPSHOT_COLUMNS[table]:
+        stored_type = source.read(1)
+        (length,) = source.unpack('<Q')
+        if stored_type != typecode.encode('ascii'):
+            raise SnapshotError(f"Niezgodny typ kolumny {table}.{name}")
+        try:
+            columns.append(_decode_column(typecode, zlib.decompress(source.read(length)), row_count))
+        except (zlib.error, struct.error, UnicodeDecodeError, IndexError) as e:
+            raise SnapshotError(f"Uszkodzona kolumna {table}.{name}: {e}")
+    return list(zip(*columns))
+
+
+def iter_snapshot(file: BinaryIO) -> Iterator[Tuple[str, List[str], List[tuple]]]:
+    """Zwraca kolejne partie migawki jako (tabela, kolumny, wiersze); suma kontrolna jest sprawdzana po ostatniej partii"""
+    source = _ChecksumReader(file)
+    magic = file.read(len(MAGIC))
+    if magic != MAGIC:
+        if magic.startswith(MAGIC[:-1]):
+            raise SnapshotError("Nieobsługiwana wersja migawki bazy danych")
+        raise SnapshotError("Plik nie jest migawką bazy danych")
+    source.crc = zlib.crc32(magic)
+    expected = SNAPSHOT_COLUMNS
+    (table_count,) = source.unpack('<I')
+    for _ in range(table_count):
+        (name_length,) = source.unpack('<H')
+        table = source.read(name_length).decode('utf-8', errors='replace')
+        (column_count,) = source.unpack('<H')
+        if table not in expected or len(expected[table]) != column_count:
+            raise SnapshotError(f"Nieznana tabela w migawce: {table}")
+        names = [name for name, _ in expected[table]]
+        while True:
+            (row_count,) = source.unpack('<I')
+            if not row_count:
+                break
+            yield table, names, _read_batch(source, table, row_count)
+    trailer = file.read(5)
+    if len(trailer) != 4 or struct.unpack('<I', trailer)[0] != source.crc:
+        raise SnapshotError("Niezgodna suma kontrolna migawki")
+
+
+def import_snapshot(path: str, db_path: str = 'movies.db') -> Dict[str, int]:
+    """Odtwarza bazę danych z migawki w jednej transakcji, zatwierdzanej dopiero po sprawdzeniu sumy kontrolnej"""
+    create_database(db_path)
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    counts = {table: 0 for table, _ in SNAPSHOT_TABLES}
+    restored = set()
+    try:
+        restore_derived = get_shard_count(cursor) == 1
+        with bulk_replace(conn, db_path, rebuild=not restore_derived) as shards:
+            for table, _ in reversed(SNAPSHOT_TABLES):
+                for target in (shards if table in SHARDED_TABLES else [conn]):
+                    target.execute(f'DELETE FROM {table}')
+            if restore_derived:
+                for table in DERIVED_TABLES:
+                    cursor.execute(f'DELETE FROM {table}')
+            with open(path, 'rb') as file:
+                for table, columns, rows in iter_snapshot(file):
+                    if table in DERIVED_TABLES:
+                        if not restore_derived:
+                            continue
+                        restored.add(table)
+                    placeholders = ', '.join('?' for _ in columns)
+                    query = f'INSERT INTO {table} ({", ".join(columns)}) VALUES ({placeholders})'
+                    if table in SHARDED_TABLES and len(shards) > 1:
+                        for index, routed in _route_rows(rows, len(shards)).items():
+                            shards[index].executemany(query, routed)
+                    else:
+                        cursor.executemany(query, rows)
+                    if table in counts:
+                        counts[table] += len(rows)
+            # Migawka bazy z podziałem na shardy nie zawiera tabel pochodnych
+            # (pusta tabela też nie ma partii, ale wtedy przeliczenie nic nie kosztuje)
+            if restore_derived and not restored >= {'tag_vocabulary', 'movie_tag_counts'}:
+                rebuild_tag_vocabulary(cursor)
+            if restore_derived and not restored >= set(ROLLUP_TABLES):
+                rebuild_rating_rollups(cursor)
+    finally:
+        conn.close()
+    return counts
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] not in ('export', 'import'):
+        print("Użycie: python snapshot.py export|import <plik migawki>")
+        sys.exit(1)
+    if sys.argv[1] == 'export':
+        counts = export_snapshot(sys.argv[2])
+        print(f"Zapisano migawkę {sys.argv[2]}: {counts}")
+    else:
+        counts = import_snapshot(sys.argv[2])
+        print(f"Odtworzono bazę danych z migawki {sys.argv[2]}: {counts}")
@@ -1,7 +1,12 @@
+import asyncio
+import os
 import pytest
 import sqlite3
+import threading
 import time
 from fastapi.testclient import TestClient
+import main
+from database import create_database, prune_change_log, reshard
 from main import app, get_db_connection
 
 
@@ -10,29 +15,18 @@ def client():
     return TestClient(app)
 
 
-def _wait_and_clear_db():
-    time.sleep(0.2)
-    retries = 15
-    while retries > 0:
-        try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute('DELETE FROM tags')
-            cursor.execute('DELETE FROM ratings')
-            cursor.execute('DELETE FROM links')
-            cursor.execute('DELETE FROM movies')
-            conn.commit()
-            conn.close()
-            return
-        except sqlite3.OperationalError:
-            if conn:
-                try:
-                    conn.close()
-                except:
-                    pass
-            retries -= 1
-            time.sleep(0.25)
-    raise sqlite3.OperationalError("Could not acquire database lock")
+@main.retry_on_busy
+def _clear_db():
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM tags')
+        cursor.execute('DELETE FROM ratings')
+        cursor.execute('DELETE FROM links')
+        cursor.execute('DELETE FROM movies')
+        conn.commit()
+    finally:
+        conn.close()
 
 
 def _populate_test_data():
@@ -90,16 +84,13 @@ def _populate_test_data():
 
 @pytest.fixture(scope="function")
 def setup_test_db():
-    _wait_and_clear_db()
+    _clear_db()
     _populate_test_data()
 
     yield
 
     # Teardown
-    try:
-        _wait_and_clear_db()
-    except Exception:
-        pass
+    _clear_db()
 
 
 # ============ MOVIES TESTS ============
@@ -140,6 +131,13 @@ class TestMovies:
         resp = client.post("/movies", json=new)
         assert resp.status_code == 400
 
+    def test_failed_create_releases_database(self, client, setup_test_db):
+        """Test POST /movies - nieudany zapis nie blokuje kolejnych zapisów"""
+        assert client.post("/movies", json={"movieId": 1, "title": "Dup"}).status_code == 400
+        resp = client.put("/movies/1", json={"movieId": 1, "title": "After", "genres": None})
+        assert resp.status_code == 200
+        assert resp.json() == {"movieId": 1, "title": "After", "genres": None}
+
     def test_get_single_movie(self, client, setup_test_db):
         """Test GET /movies/{movie_id}"""
         resp = client.get("/movies/1")
@@ -297,6 +295,45 @@ class TestRatings:
         assert verify.status_code == 404
 
 
+@pytest.fixture(scope="function")
+def rating_index_enabled(setup_test_db, monkeypatch):
+    monkeypatch.setattr(main, "RATING_INDEX_REFRESH", 60.0)
+    main.refresh_rating_indexes(0)
+
+    yield
+
+    for index in main._rating_indexes.values():
+        index.close()
+        os.remove(index.path)
+    main._rating_indexes.clear()
+
+
+class TestRatingIndex:
+    """Testy odczytu ocen przez indeks mapowany do pamięci"""
+
+    def test_read_rating_from_index(self, client, rating_index_enabled):
+        """Odczyt oceny korzysta z indeksu i widzi zapisy nowsze niż indeks"""
+        assert client.get("/ratings/1/2").json()['rating'] == 3.5
+        assert main.DB_PATH in main._rating_indexes
+
+        client.post("/ratings", json={"userId": 3, "movieId": 1, "rating": 2.0, "timestamp": 1000200})
+        client.put("/ratings/1/2", json={"userId": 1, "movieId": 2, "rating": 1.5, "timestamp": 1000201})
+        client.delete("/ratings/2/1")
+        assert client.get("/ratings/3/1").json()['rating'] == 2.0
+        assert client.get("/ratings/1/2").json()['rating'] == 1.5
+        assert client.get("/ratings/2/1").status_code == 404
+
+    def test_refresh_rebuilds_index(self, client, rating_index_enabled):
+        """Odświeżenie przebudowuje indeks i przełącza odczyty na nowy plik"""
+        client.get("/ratings/1/1")
+        client.post("/ratings", json={"userId": 3, "movieId": 1, "rating": 2.0, "timestamp": 1000200})
+        main.refresh_rating_indexes(0)
+
+        index = main._rating_indexes[main.DB_PATH]
+        assert index.count == 4
+        assert client.get("/ratings/3/1").json()['rating'] == 2.0
+
+
 # ============ TAGS TESTS ============
 
 class TestTags:
@@ -352,6 +389,421 @@ class TestTags:
         assert verify.status_code == 404
 
 
+# ============ MOVIE DETAILS TESTS ============
+
+class TestMovieDetails:
+    """Testy dla zbiorczych endpointów filmów"""
+
+    def test_get_movie_full(self, client, setup_test_db):
+        """Test GET /movies/{movie_id}/full"""
+        resp = client.get("/movies/1/full")
+        assert resp.status_code == 200
+        data = resp.json()
+        assert data['movie'] == {"movieId": 1, "title": "Test Movie 1", "genres": "Action|Adventure"}
+        assert data['link']['imdbId'] == 'tt0111161'
+        assert data['ratings'] == {"count": 2, "average": 4.75}
+        assert sorted(t['tag'] for t in data['tags']) == ['epic', 'masterpiece']
+
+    def test_get_movie_full_without_link_and_ratings(self, client, setup_test_db):
+        """Test GET /movies/{movie_id}/full - film bez linku i ocen"""
+        resp = client.get("/movies/3/full")
+        assert resp.status_code == 200
+        data = resp.json()
+        assert data['link'] is None
+        assert data['ratings'] == {"count": 0, "average": None}
+        assert data['tags'] == []
+
+    def test_get_movie_full_not_found(self, client, setup_test_db):
+        """Test GET /movies/{movie_id}/full - 404"""
+        resp = client.get("/movies/999/full")
+        assert resp.status_code == 404
+
+    def test_get_movies_by_ids(self, client, setup_test_db):
+        """Test GET /movies?ids=... - kolejność z zapytania, brakujące pomijane"""
+        resp = client.get("/movies", params={"ids": "3,1,999,3"})
+        assert resp.status_code == 200
+        assert [m['movieId'] for m in resp.json()] == [3, 1]
+
+    def test_get_movies_by_ids_invalid(self, client, setup_test_db):
+        """Test GET /movies?ids=... - niepoprawny identyfikator"""
+        resp = client.get("/movies", params={"ids": "1,abc"})
+        assert resp.status_code == 400
+
+
+# ============ RATING TRENDS TESTS ============
+
+class TestRatingTrends:
+    """Testy dla endpointów korzystających z agregatów ocen"""
+
+    def test_movie_timeline_by_day(self, client, setup_test_db):
+        """Test GET /movies/{movie_id}/timeline - kubełki dzienne"""
+        client.post("/ratings", json={"userId": 3, "movieId": 1, "rating": 3.0, "timestamp": 1000000 + 86400})
+        resp = client.get("/movies/1/timeline")
+        assert resp.status_code == 200
+        assert resp.json() == [
+            {"start": 950400, "count": 2, "average": 4.75},
+            {"start": 1036800, "count": 1, "average": 3.0},
+        ]
+
+    def test_movie_timeline_by_week_follows_updates(self, client, setup_test_db):
+        """Test GET /movies/{movie_id}/timeline - kubełki tygodniowe po aktualizacji i usunięciu"""
+        client.put("/ratings/1/1", json={"userId": 1, "movieId": 1, "rating": 2.0, "timestamp": 1000000})
+        client.delete("/ratings/2/1")
+        resp = client.get("/movies/1/timeline", params={"bucket": "week"})
+        assert resp.status_code == 200
+        assert resp.json() == [{"start": 950400, "count": 1, "average": 2.0}]
+
+    def test_movie_timeline_invalid_bucket(self, client, setup_test_db):
+        """Test GET /movies/{movie_id}/timeline - nieznany kubełek"""
+        resp = client.get("/movies/1/timeline", params={"bucket": "year"})
+        assert resp.status_code == 422
+
+    def test_trending_movies(self, client, setup_test_db):
+        """Test GET /movies/trending"""
+        resp = client.get("/movies/trending", params={"timestamp": 1000000})
+        assert resp.status_code == 200
+        data = resp.json()
+        assert [(m['movieId'], m['count']) for m in data] == [(1, 2), (2, 1)]
+        assert data[0]['title'] == 'Test Movie 1'
+        assert data[0]['average'] == 4.75
+
+    def test_trending_movies_empty_week(self, client, setup_test_db):
+        """Test GET /movies/trending - tydzień bez ocen"""
+        resp = client.get("/movies/trending", params={"timestamp": 5000000})
+        assert resp.status_code == 200
+        assert resp.json() == []
+
+
+# ============ TAG VOCABULARY TESTS ============
+
+class TestTagVocabulary:
+    """Testy dla słownika tagów i endpointów z licznikami"""
+
+    def test_movie_top_tags(self, client, setup_test_db):
+        """Test GET /movies/{movie_id}/tags/top"""
+        client.post("/tags", json={"userId": 3, "movieId": 1, "tag": "epic", "timestamp": 2000100})
+        resp = client.get("/movies/1/tags/top")
+        assert resp.status_code == 200
+        data = resp.json()
+        assert [(t['tag'], t['count']) for t in data] == [('epic', 2), ('masterpiece', 1)]
+
+    def test_popular_tags(self, client, setup_test_db):
+        """Test GET /tags/popular"""
+        client.post("/tags", json={"userId": 3, "movieId": 2, "tag": "epic", "timestamp": 2000100})
+        resp = client.get("/tags/popular", params={"limit": 1})
+        assert resp.status_code == 200
+        assert [(t['tag'], t['count']) for t in resp.json()] == [('epic', 2)]
+
+    def test_counts_follow_delete(self, client, setup_test_db):
+        """Liczniki maleją po usunięciu tagu"""
+        client.delete("/tags/1/1/epic")
+        data = client.get("/movies/1/tags/top").json()
+        assert [t['tag'] for t in data] == ['masterpiece']
+        popular = [t['tag'] for t in client.get("/tags/popular").json()]
+        assert 'epic' not in popular
+
+
+# ============ MULTI-WORKER TESTS ============
+
+class TestMultiWorker:
+    """Testy koordynacji wielu procesów na wspólnej bazie"""
+
+    def test_list_cache_invalidated_by_other_connection(self, client, setup_test_db):
+        """Zapis z innego połączenia (procesu) unieważnia pamięć podręczną listy"""
+        assert len(client.get("/movies").json()) == 3
+        conn = get_db_connection()
+        conn.execute("INSERT INTO movies (movieId, title, genres) VALUES (4, 'Other Worker', NULL)")
+        conn.commit()
+        conn.close()
+
+        data = client.get("/movies").json()
+        assert [m['movieId'] for m in data] == [1, 2, 3, 4]
+
+    def test_write_retried_while_database_busy(self, client, setup_test_db, monkeypatch):
+        """Zapis czeka z ponowieniami, aż inny proces zwolni blokadę zapisu"""
+        monkeypatch.setattr(main, "BUSY_TIMEOUT", 0.01)
+        blocker = sqlite3.connect(main.DB_PATH, check_same_thread=False)
+        blocker.execute("BEGIN IMMEDIATE")
+        timer = threading.Timer(0.3, blocker.rollback)
+        timer.start()
+        try:
+            resp = client.post("/movies", json={"movieId": 80, "title": "Busy", "genres": None})
+        finally:
+            timer.join()
+            blocker.close()
+        assert resp.status_code == 201
+
+    def test_busy_wait_is_bounded(self, setup_test_db, monkeypatch):
+        """Łączny czas czekania na zajętą bazę nie przekracza RETRY_MAX_WAIT"""
+        monkeypatch.setattr(main, "RETRY_MAX_WAIT", 0.3)
+        blocker = sqlite3.connect(main.DB_PATH)
+        blocker.execute("BEGIN IMMEDIATE")
+        started = time.monotonic()
+        try:
+            with pytest.raises(sqlite3.OperationalError):
+                main.execute_write("INSERT INTO movies (movieId, title, genres) VALUES (81, 'Busy', NULL)", ())
+        finally:
+            blocker.rollback()
+            blocker.close()
+        assert time.monotonic() - started < 1.0
+
+    def test_handlers_run_outside_event_loop(self):
+        """Endpointy korzystające z bazy nie są korutynami, więc blokada bazy nie wstrzymuje pętli zdarzeń"""
+        assert not asyncio.iscoroutinefunction(main.create_movie)
+        assert not asyncio.iscoroutinefunction(main.read_movie_details)
+
+
+# ============ SHARDING TESTS ============
+
+@pytest.fixture(scope="function")
+def sharded_db(setup_test_db):
+    reshard(3, main.DB_PATH)
+    main.reload_shard_config()
+
+    yield
+
+    reshard(1, main.DB_PATH)
+    main.reload_shard_config()
+
+
+def _shard_rows(user_id, query, params):
+    conn = sqlite3.connect(main.user_db_path(user_id))
+    rows = conn.execute(query, params).fetchall()
+    conn.close()
+    return rows
+
+
+class TestSharding:
+    """Testy dla ocen i tagów podzielonych na kilka plików"""
+
+    def test_point_operations_routed_to_user_shard(self, client, sharded_db):
+        """Odczyt i zapis oceny trafiają do shardu użytkownika"""
+        assert len(main.get_shard_paths()) == 3
+        assert client.get("/ratings/1/1").json()['rating'] == 5.0
+
+        resp = client.post("/ratings", json={"userId": 5, "movieId": 3, "rating": 2.0, "timestamp": 1000300})
+        assert resp.status_code == 201
+        assert _shard_rows(5, 'SELECT rating FROM ratings WHERE userId = 5', ()) == [(2.0,)]
+        assert client.put("/ratings/5/3", json={"userId": 5, "movieId": 3, "rating": 3.0,
+                                                "timestamp": 1000301}).json()['rating'] == 3.0
+        assert client.delete("/ratings/5/3").status_code == 200
+        assert client.get("/ratings/5/3").status_code == 404
+
+    def test_lists_gathered_from_all_shards(self, client, sharded_db):
+        """Listy ocen i tagów zawierają wiersze ze wszystkich shardów"""
+        ratings = client.get("/ratings").json()
+        assert sorted((r['userId'], r['movieId']) for r in ratings) == [(1, 1), (1, 2), (2, 1)]
+        assert len(client.get("/tags").json()) == 2
+
+    def test_fan_out_pool_follows_shard_count(self, client, sharded_db):
+        """Pula fan_out jest tworzona od nowa po zmianie układu shardów"""
+        assert sorted(main.fan_out(lambda path: path)) == sorted(main.get_shard_paths())
+        assert main._fan_out_pool._max_workers == 3
+
+        reshard(2, main.DB_PATH)
+        main.reload_shard_config()
+        assert main._fan_out_pool is None
+        assert len(main.fan_out(lambda path: path)) == 2
+        assert main._fan_out_pool._max_workers == 2
+
+    def test_aggregates_merged_across_shards(self, client, sharded_db):
+        """Agregaty sumują dane użytkowników z różnych shardów"""
+        details = client.get("/movies/1/full").json()
+        assert details['ratings'] == {"count": 2, "average": 4.75}
+
+        trending = client.get("/movies/trending", params={"timestamp": 1000000}).json()
+        assert [(m['movieId'], m['count'], m['title']) for m in trending] == [
+            (1, 2, 'Test Movie 1'), (2, 1, 'Test Movie 2'),
+        ]
+        timeline = client.get("/movies/1/timeline").json()
+        assert timeline == [{"start": 950400, "count": 2, "average": 4.75}]
+
+    def test_tag_counts_use_global_tag_ids(self, client, sharded_db):
+        """Tagi z różnych shardów są łączone po tekście znormalizowanym z identyfikatorem ze wspólnego słownika"""
+        client.post("/tags", json={"userId": 3, "movieId": 1, "tag": "masterpiece", "timestamp": 2000100})
+        client.post("/tags", json={"userId": 4, "movieId": 2, "tag": "brand new", "timestamp": 2000101})
+        client.post("/tags", json={"userId": 4, "movieId": 1, "tag": "Masterpiece ", "timestamp": 2000102})
+
+        top = client.get("/movies/1/tags/top").json()
+        assert [(t['tag'], t['count']) for t in top] == [('masterpiece', 3), ('epic', 1)]
+        popular = {t['tag']: t for t in client.get("/tags/popular").json()}
+        conn = get_db_connection()
+        tag_id = conn.execute("SELECT tagId FROM tag_vocabulary WHERE tag = 'brand new'").fetchone()[0]
+        conn.close()
+        assert popular['brand new']['tagId'] == tag_id
+
+    def test_changes_per_shard(self, client, sharded_db):
+        """Każdy shard ma własny dziennik zmian"""
+        client.post("/ratings", json={"userId": 4, "movieId": 2, "rating": 1.0, "timestamp": 1000400})
+        shard = main.get_shard_paths().index(main.user_db_path(4))
+
+        feed = client.get("/changes", params={"shard": shard}).json()
+        assert [(c['table'], c['op'], c['key']) for c in feed['changes']] == [('ratings', 'insert', [4, 2])]
+        assert feed['shards'] == 3
+        assert client.get("/changes", params={"shard": 3}).status_code == 404
+
+
+# ============ CHANGES TESTS ============
+
+def _last_change_seq():
+    conn = get_db_connection()
+    seq = conn.execute('SELECT COALESCE(MAX(seq), 0) FROM change_log').fetchone()[0]
+    conn.close()
+    return seq
+
+
+class TestChanges:
+    """Testy dla dziennika zmian i endpointu /changes"""
+
+    def test_changes_follow_writes(self, client, setup_test_db):
+        """Test GET /changes - zapis, aktualizacja i usunięcie oceny"""
+        since = _last_change_seq()
+        client.post("/ratings", json={"userId": 3, "movieId": 2, "rating": 4.0, "timestamp": 1000100})
+        client.put("/ratings/3/2", json={"userId": 3, "movieId": 2, "rating": 2.5, "timestamp": 1000101})
+        client.delete("/ratings/3/2")
+
+        resp = client.get("/changes", params={"since": since})
+        assert resp.status_code == 200
+        data = resp.json()
+        assert [(c['table'], c['op'], c['key']) for c in data['changes']] == [
+            ('ratings', 'insert', [3, 2]),
+            ('ratings', 'update', [3, 2]),
+            ('ratings', 'delete', [3, 2]),
+        ]
+        assert data['changes'][1]['payload']['rating'] == 2.5
+        assert data['last_seq'] == data['changes'][-1]['seq']
+
+        resp = client.get("/changes", params={"since": data['last_seq']})
+        assert resp.json() == {"changes": [], "last_seq": data['last_seq'], "generation": data['generation'],
+                               "shards": 1}
+
+    def test_changes_limit(self, client, setup_test_db):
+        """Test GET /changes - stronicowanie przez limit i last_seq"""
+        since = _last_change_seq()
+        client.post("/tags", json={"userId": 5, "movieId": 1, "tag": "a", "timestamp": 1})
+        client.post("/tags", json={"userId": 5, "movieId": 1, "tag": "b", "timestamp": 2})
+
+        first = client.get("/changes", params={"since": since, "limit": 1}).json()
+        second = client.get("/changes", params={"since": first['last_seq'], "limit": 1}).json()
+        assert first['changes'][0]['key'] == [5, 1, 'a']
+        assert second['changes'][0]['key'] == [5, 1, 'b']
+
+    def test_changes_long_poll(self, client, setup_test_db):
+        """Test GET /changes?wait= - czeka na zmianę z innego połączenia"""
+        since = _last_change_seq()
+
+        def write():
+            conn = get_db_connection()
+            conn.execute("INSERT INTO movies (movieId, title, genres) VALUES (90, 'Later', NULL)")
+            conn.commit()
+            conn.close()
+
+        timer = threading.Timer(0.3, write)
+        timer.start()
+        resp = client.get("/changes", params={"since": since, "wait": 5})
+        timer.join()
+        assert resp.status_code == 200
+        assert [(c['table'], c['key']) for c in resp.json()['changes']] == [('movies', [90])]
+
+    def test_changes_report_generation(self, client, setup_test_db):
+        """Test GET /changes - generacja zmienia się po masowej wymianie danych"""
+        before = client.get("/changes", params={"since": _last_change_seq()}).json()['generation']
+        conn = get_db_connection()
+        conn.execute("INSERT OR REPLACE INTO settings (name, value) VALUES ('generation', 'replaced')")
+        conn.commit()
+        conn.close()
+        try:
+            after = client.get("/changes", params={"since": _last_change_seq()}).json()['generation']
+            assert before != after == 'replaced'
+        finally:
+            conn = get_db_connection()
+            conn.execute("INSERT OR REPLACE INTO settings (name, value) VALUES ('generation', ?)", (before,))
+            conn.commit()
+            conn.close()
+
+    def test_pruned_changes_gone(self, client, setup_test_db):
+        """Test GET /changes - 410 dla zmian usuniętych z dziennika"""
+        since = _last_change_seq()
+        client.post("/ratings", json={"userId": 3, "movieId": 2, "rating": 4.0, "timestamp": 1000100})
+        client.delete("/ratings/3/2")
+        conn = get_db_connection()
+        try:
+            prune_change_log(conn.cursor(), keep=1)
+            conn.commit()
+
+            resp = client.get("/changes", params={"since": since})
+            assert resp.status_code == 410
+            assert resp.json()['detail']['horizon'] == since + 1
+            assert resp.json()['detail']['last_seq'] == since + 2
+            resp = client.get("/changes", params={"since": since + 1})
+            assert resp.status_code == 200
+            assert [c['op'] for c in resp.json()['changes']] == ['delete']
+        finally:
+            conn.execute("DELETE FROM settings WHERE name = 'change_log_horizon'")
+            conn.commit()
+            conn.close()
+
+
+# ============ MAINTENANCE TESTS ============
+
+class TestMaintenance:
+    """Testy dla endpointów /admin/db"""
+
+    def test_stats_and_analyze(self, client, setup_test_db):
+        """Test GET /admin/db/stats i POST /admin/db/analyze"""
+        stats = client.get("/admin/db/stats").json()
+        assert [s['path'] for s in stats] == [main.DB_PATH]
+        assert stats[0]['page_count'] > 0
+
+        resp = client.post("/admin/db/analyze")
+        assert resp.status_code == 200
+        report = resp.json()[0]
+        assert report['operation'] == 'analyze' and report['seconds'] >= 0
+
+    def test_vacuum_incremental_database(self, client, tmp_path, monkeypatch):
+        """Test POST /admin/db/vacuum - baza w trybie auto_vacuum=INCREMENTAL oddaje wolne strony"""
+        db_path = str(tmp_path / "movies.db")
+        create_database(db_path)
+        conn = sqlite3.connect(db_path)
+        conn.execute('CREATE TABLE scratch (payload TEXT)')
+        conn.executemany('INSERT INTO scratch VALUES (?)', [('x' * 200,) for _ in range(500)])
+        conn.commit()
+        conn.execute('DELETE FROM scratch')
+        conn.commit()
+        conn.close()
+        monkeypatch.setattr(main, "DB_PATH", db_path)
+
+        resp = client.post("/admin/db/vacuum", params={"max_pages": 8})
+        assert resp.status_code == 200
+        report = resp.json()[0]
+        assert report['freelist_before'] - report['freelist_after'] == 8
+
+    def test_vacuum_legacy_database(self, client, tmp_path, monkeypatch):
+        """Test POST /admin/db/vacuum - 409 dla bazy bez trybu auto_vacuum=INCREMENTAL"""
+        db_path = str(tmp_path / "movies.db")
+        conn = sqlite3.connect(db_path)
+        conn.execute('CREATE TABLE legacy (x)')  # Tryb auto_vacuum ustala się przy tworzeniu pierwszej tabeli
+        conn.close()
+        create_database(db_path)
+        monkeypatch.setattr(main, "DB_PATH", db_path)
+
+        assert client.get("/admin/db/stats").json()[0]['auto_vacuum'] == 'none'
+        resp = client.post("/admin/db/vacuum", params={"max_pages": 8})
+        assert resp.status_code == 409
+
+    def test_backup(self, client, setup_test_db, tmp_path, monkeypatch):
+        """Test POST /admin/db/backup - kopia zawiera dane bazy"""
+        monkeypatch.setattr(main, "BACKUP_DIR", str(tmp_path))
+        resp = client.post("/admin/db/backup")
+        assert resp.status_code == 201
+        backups = list(tmp_path.glob("movies-*.db"))
+        assert len(backups) == 1
+
+        conn = sqlite3.connect(backups[0])
+        assert conn.execute('SELECT COUNT(*) FROM movies').fetchone() == (3,)
+        conn.close()
+
+
 # ============ INTEGRATION TESTS ============
 
 class TestIntegration:
@@ -0,0 +1,690 @@
+import os
+import sqlite3
+
+import pytest
+
+import database
+import maintenance
+import rating_index
+import snapshot
+
+
+RATINGS_CSV = (
+    "userId,movieId,rating,timestamp\n"
+    + "".join(f"{i % 7 + 1},{i},{(i % 10) / 2 + 0.5},{1000000 + i}\n" for i in range(500))
+)
+
+
+# ============ CSV INGEST TESTS ============
+
+class TestCsvIngest:
+    """Testy dla strumieniowego wczytywania plików CSV"""
+
+    def test_chunks_cover_whole_file(self, tmp_path):
+        """Zakresy bajtów pokrywają cały plik bez nagłówka i kończą się na końcu wiersza"""
+        path = tmp_path / "ratings.csv"
+        path.write_text(RATINGS_CSV, encoding="utf-8")
+        data = path.read_bytes()
+
+        chunks = list(database._csv_chunks(str(path), chunk_size=256))
+        assert len(chunks) > 1
+        assert chunks[0][0] == data.index(b"\n") + 1
+        assert chunks[-1][1] == len(data)
+        for (_, end), (start, _) in zip(chunks, chunks[1:]):
+            assert end == start
+            assert data[end - 1:end] == b"\n"
+
+    def test_parallel_batches_match_sequential(self, tmp_path, monkeypatch):
+        """Równoległe parsowanie zwraca te same wiersze w tej samej kolejności"""
+        path = tmp_path / "ratings.csv"
+        path.write_text(RATINGS_CSV, encoding="utf-8")
+        converters = (int, int, float, int)
+        monkeypatch.setattr(database, "CHUNK_SIZE", 1024)
+
+        sequential = [row for batch in database._read_batches(str(path), converters) for row in batch]
+        parallel = [row for batch in database.csv_batches(str(path), converters, True, workers=2)
+                    for row in batch]
+        assert len(sequential) == 500
+        assert parallel == sequential
+        assert sequential[0] == (1, 0, 0.5, 1000000)
+
+    def test_optional_columns_converted(self, tmp_path):
+        """Puste tmdbId jest zapisywane jako NULL"""
+        path = tmp_path / "links.csv"
+        path.write_text("movieId,imdbId,tmdbId\n1,0114709,862\n2,0113497,\n", encoding="utf-8")
+        converters = (int, str, database._optional_str)
+
+        rows = [row for batch in database.csv_batches(str(path), converters) for row in batch]
+        assert rows == [(1, '0114709', '862'), (2, '0113497', None)]
+
+    def test_failed_load_keeps_triggers(self, tmp_path, monkeypatch):
+        """Błąd w trakcie ładowania wycofuje całą transakcję razem z usunięciem wyzwalaczy"""
+        monkeypatch.chdir(tmp_path)
+        (tmp_path / "movies.csv").write_text("movieId,title,genres\n1,A,Drama\n", encoding="utf-8")
+        (tmp_path / "ratings.csv").write_text("userId,movieId,rating,timestamp\n1,1,bad,5\n", encoding="utf-8")
+        database.create_database()
+
+        with pytest.raises(ValueError):
+            database.load_data_from_csv(workers=1)
+        assert _trigger_count("movies.db") == len(database._triggers())
+        assert _dump("movies.db")['movies'] == []
+
+
+# ============ SNAPSHOT TESTS ============
+
+def _populate(db_path):
+    database.create_database(db_path)
+    conn = sqlite3.connect(db_path)
+    conn.executemany('INSERT INTO movies (movieId, title, genres) VALUES (?, ?, ?)',
+                     [(1, 'Test Movie 1', 'Action|Adventure'), (2, 'Test Movie 2', None),
+                      (3, 'Żółta łódź', 'Action|Adventure')])
+    conn.executemany('INSERT INTO links (movieId, imdbId, tmdbId) VALUES (?, ?, ?)',
+                     [(1, '0111161', '278'), (2, '0068646', None)])
+    conn.executemany('INSERT INTO ratings (userId, movieId, rating, timestamp) VALUES (?, ?, ?, ?)',
+                     [(1, 1, 5.0, 1000000), (2, 1, 4.5, 1000001), (1, 2, 3.5, 1000002)])
+    conn.executemany('INSERT INTO tags (userId, movieId, tag, timestamp) VALUES (?, ?, ?, ?)',
+                     [(1, 1, 'epic', 2000000), (2, 1, 'epic', 2000001), (2, 2, 'funny', 2000002)])
+    conn.commit()
+    conn.close()
+
+
+def _trigger_count(db_path):
+    conn = sqlite3.connect(db_path)
+    count = conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger'").fetchone()[0]
+    conn.close()
+    return count
+
+
+def _dump(db_path):
+    conn = sqlite3.connect(db_path)
+    dump = {table: conn.execute(f'SELECT * FROM {table} ORDER BY 1, 2').fetchall()
+            for table, _ in snapshot.SNAPSHOT_TABLES}
+    conn.close()
+    return dump
+
+
+def _derived(db_path):
+    conn = sqlite3.connect(db_path)
+    derived = {table: conn.execute(f'SELECT * FROM {table} ORDER BY 1, 2').fetchall()
+               for table in database.DERIVED_TABLES}
+    conn.close()
+    return derived
+
+
+class TestSnapshot:
+    """Testy dla binarnej migawki bazy danych"""
+
+    def test_round_trip(self, tmp_path):
+        """Eksport i import odtwarzają identyczną zawartość tabel"""
+        source, target, snap = tmp_path / "source.db", tmp_path / "target.db", tmp_path / "movies.snap"
+        _populate(str(source))
+
+        exported = snapshot.export_snapshot(str(snap), str(source))
+        imported = snapshot.import_snapshot(str(snap), str(target))
+        assert exported == imported == {'movies': 3, 'links': 2, 'ratings': 3, 'tags': 3}
+        assert _dump(str(target)) == _dump(str(source))
+
+    def test_round_trip_in_batches(self, tmp_path, monkeypatch):
+        """Tabele większe niż partia są zapisywane i odtwarzane w kilku partiach"""
+        source, target, snap = tmp_path / "source.db", tmp_path / "target.db", tmp_path / "movies.snap"
+        _populate(str(source))
+        monkeypatch.setattr(snapshot, "SNAPSHOT_BATCH_ROWS", 2)
+
+        snapshot.export_snapshot(str(snap), str(source))
+        with open(snap, 'rb') as file:
+            batches = [(table, len(rows)) for table, _, rows in snapshot.iter_snapshot(file)]
+        assert batches[:7] == [('movies', 2), ('movies', 1), ('links', 2), ('ratings', 2), ('ratings', 1),
+                               ('tags', 2), ('tags', 1)]
+        snapshot.import_snapshot(str(snap), str(target))
+        assert _dump(str(target)) == _dump(str(source))
+
+    def test_checksum_failure_rolls_back_import(self, tmp_path):
+        """Suma kontrolna sprawdzana po ostatniej partii cofa wstawione już wiersze"""
+        source, snap = tmp_path / "source.db", tmp_path / "movies.snap"
+        _populate(str(source))
+        snapshot.export_snapshot(str(snap), str(source))
+        before = _dump(str(source))
+        data = bytearray(snap.read_bytes())
+        data[-1] ^= 0xFF
+        snap.write_bytes(bytes(data))
+
+        with pytest.raises(snapshot.SnapshotError):
+            snapshot.import_snapshot(str(snap), str(source))
+        assert _dump(str(source)) == before
+        assert _trigger_count(str(source)) == len(database._triggers())
+
+    def test_derived_tables_restored_from_snapshot(self, tmp_path, monkeypatch):
+        """Tabele pochodne są odtwarzane z migawki zamiast przeliczania"""
+        source, target, snap = tmp_path / "source.db", tmp_path / "target.db", tmp_path / "movies.snap"
+        _populate(str(source))
+        snapshot.export_snapshot(str(snap), str(source))
+
+        def fail(cursor):
+            raise AssertionError("tabele pochodne przeliczane mimo zapisu w migawce")
+        monkeypatch.setattr(snapshot, "rebuild_tag_vocabulary", fail)
+        monkeypatch.setattr(snapshot, "rebuild_rating_rollups", fail)
+        monkeypatch.setattr(database, "rebuild_derived_tables", fail)
+        snapshot.import_snapshot(str(snap), str(target))
+        assert _derived(str(target)) == _derived(str(source))
+        assert _trigger_count(str(target)) == len(database._triggers())
+
+    def test_import_replaces_existing_rows(self, tmp_path):
+        """Import zastępuje dotychczasową zawartość bazy"""
+        source, snap = tmp_path / "source.db", tmp_path / "movies.snap"
+        _populate(str(source))
+        snapshot.export_snapshot(str(snap), str(source))
+
+        snapshot.import_snapshot(str(snap), str(source))
+        assert len(_dump(str(source))['ratings']) == 3
+
+    def test_corrupted_snapshot_rejected(self, tmp_path):
+        """Zmieniony bajt migawki jest wykrywany przez sumę kontrolną"""
+        source, snap = tmp_path / "source.db", tmp_path / "movies.snap"
+        _populate(str(source))
+        snapshot.export_snapshot(str(snap), str(source))
+        data = bytearray(snap.read_bytes())
+        data[len(snapshot.MAGIC) + 6] ^= 0xFF
+        snap.write_bytes(bytes(data))
+
+        with open(snap, 'rb') as file, pytest.raises(snapshot.SnapshotError):
+            list(snapshot.iter_snapshot(file))
+
+    def test_failed_import_keeps_triggers(self, tmp_path, monkeypatch):
+        """Błąd w trakcie importu zostawia bazę z danymi i wyzwalaczami"""
+        source, snap = tmp_path / "source.db", tmp_path / "movies.snap"
+        _populate(str(source))
+        snapshot.export_snapshot(str(snap), str(source))
+        before = _dump(str(source))
+
+        def fail(cursor):
+            raise sqlite3.OperationalError("przerwany import")
+        monkeypatch.setattr(database, "mark_bulk_replaced", fail)
+        with pytest.raises(sqlite3.OperationalError):
+            snapshot.import_snapshot(str(snap), str(source))
+        assert _trigger_count(str(source)) == len(database._triggers())
+        assert _dump(str(source)) == before
+
+
+# ============ TAG VOCABULARY TESTS ============
+
+class TestTagVocabulary:
+    """Testy dla słownika tagów utrzymywanego przez wyzwalacze"""
+
+    def test_counts_match_tags_table(self, tmp_path):
+        """Liczniki po wstawieniu i usunięciu tagów zgadzają się z GROUP BY po tekście znormalizowanym"""
+        db_path = str(tmp_path / "movies.db")
+        _populate(db_path)
+        conn = sqlite3.connect(db_path)
+        conn.execute("DELETE FROM tags WHERE userId = 2 AND movieId = 2")
+        conn.execute("UPDATE tags SET tag = 'Epic ' WHERE userId = 1")
+        conn.execute("INSERT INTO tags VALUES (3, 2, 'EPIC', 2000003)")
+        conn.commit()
+
+        expected = conn.execute(
+            'SELECT movieId, lower(trim(tag)), COUNT(*) FROM tags GROUP BY 1, 2 ORDER BY 1, 2').fetchall()
+        counts = conn.execute(
+            'SELECT m.movieId, v.normalized, m.count FROM movie_tag_counts m '
+            'JOIN tag_vocabulary v ON v.tagId = m.tagId ORDER BY 1, 2').fetchall()
+        assert counts == expected
+        assert conn.execute('SELECT tag, normalized, count FROM tag_vocabulary WHERE count > 0').fetchall() == [
+            ('epic', 'epic', 3),
+        ]
+        conn.close()
+
+    def test_rebuild_backfills_existing_database(self, tmp_path):
+        """Baza bez słownika dostaje liczniki przy ponownym create_database"""
+        db_path = str(tmp_path / "movies.db")
+        _populate(db_path)
+        conn = sqlite3.connect(db_path)
+        conn.execute('DROP TABLE movie_tag_counts')
+        conn.execute('DROP TABLE tag_vocabulary')
+        conn.commit()
+        conn.close()
+
+        database.create_database(db_path)
+        conn = sqlite3.connect(db_path)
+        popular = conn.execute('SELECT tag, count FROM tag_vocabulary ORDER BY count DESC, tag').fetchall()
+        assert popular == [('epic', 2), ('funny', 1)]
+        conn.close()
+
+
+# ============ RATING ROLLUP TESTS ============
+
+class TestRatingRollups:
+    """Testy dla agregatów ocen utrzymywanych przez wyzwalacze"""
+
+    def test_bucket_boundaries(self):
+        """Tydzień zaczyna się w poniedziałek o północy UTC"""
+        monday = 950400  # 1970-01-12
+        assert database.week_start(monday) == monday
+        assert database.week_start(monday + 7 * database.DAY - 1) == monday
+        assert database.week_start(monday - 1) == monday - 7 * database.DAY
+
+    def test_triggers_match_rebuild(self, tmp_path):
+        """Agregaty utrzymywane przyrostowo zgadzają się z pełnym przeliczeniem"""
+        db_path = str(tmp_path / "movies.db")
+        _populate(db_path)
+        conn = sqlite3.connect(db_path)
+        conn.execute('UPDATE ratings SET rating = 1.0, timestamp = 3000000 WHERE userId = 1 AND movieId = 1')
+        conn.execute('DELETE FROM ratings WHERE userId = 1 AND movieId = 2')
+        conn.execute('INSERT INTO ratings VALUES (3, 2, 4.0, 1000003)')
+        conn.commit()
+
+        tables = list(database.ROLLUP_TABLES)
+        maintained = {t: conn.execute(f'SELECT * FROM {t} ORDER BY 1, 2').fetchall() for t in tables}
+        database.rebuild_rating_rollups(conn.cursor())
+        rebuilt = {t: conn.execute(f'SELECT * FROM {t} ORDER BY 1, 2').fetchall() for t in tables}
+        assert maintained == rebuilt
+        assert len(maintained['rating_rollups_daily']) == 3
+        conn.close()
+
+
+# ============ CHANGE LOG TESTS ============
+
+class TestChangeLog:
+    """Testy dla dziennika zmian zapisywanego przez wyzwalacze"""
+
+    def test_key_change_logged_as_delete_and_update(self, tmp_path):
+        """Zmiana klucza wiersza daje usunięcie starego klucza i zapis nowego"""
+        db_path = str(tmp_path / "movies.db")
+        database.create_database(db_path)
+        conn = sqlite3.connect(db_path)
+        conn.execute("INSERT INTO tags VALUES (1, 1, 'a', 5)")
+        conn.execute("UPDATE tags SET tag = 'b' WHERE userId = 1")
+        conn.commit()
+
+        log = conn.execute('SELECT tbl, op, key FROM change_log ORDER BY seq').fetchall()
+        assert log == [('tags', 'insert', '[1,1,"a"]'), ('tags', 'delete', '[1,1,"a"]'),
+                       ('tags', 'update', '[1,1,"b"]')]
+        conn.close()
+
+    def test_bulk_load_not_logged(self, tmp_path, monkeypatch):
+        """Ładowanie CSV nie zapisuje wierszy do dziennika, ale podbija liczniki zmian"""
+        monkeypatch.chdir(tmp_path)
+        (tmp_path / "movies.csv").write_text("movieId,title,genres\n1,A,Drama\n", encoding="utf-8")
+        database.create_database()
+        database.load_data_from_csv(workers=1)
+
+        conn = sqlite3.connect("movies.db")
+        assert conn.execute('SELECT COUNT(*) FROM change_log').fetchone() == (0,)
+        assert conn.execute("SELECT version FROM change_counters WHERE tbl = 'movies'").fetchone() == (1,)
+        conn.close()
+
+    def test_bulk_load_changes_generation(self, tmp_path, monkeypatch):
+        """Ładowanie CSV zmienia generację danych, po której odbiorcy wykrywają pełną wymianę"""
+        monkeypatch.chdir(tmp_path)
+        (tmp_path / "movies.csv").write_text("movieId,title,genres\n1,A,Drama\n", encoding="utf-8")
+        database.create_database()
+        conn = sqlite3.connect("movies.db")
+        before = conn.execute("SELECT value FROM settings WHERE name = 'generation'").fetchone()[0]
+        database.load_data_from_csv(workers=1)
+        after = conn.execute("SELECT value FROM settings WHERE name = 'generation'").fetchone()[0]
+        conn.close()
+        assert before and after and before != after
+
+    def test_prune_keeps_recent_entries(self, tmp_path):
+        """Przycięcie usuwa stare wpisy i zapamiętuje granicę; numery nie są używane ponownie"""
+        db_path = str(tmp_path / "movies.db")
+        _populate(db_path)
+        conn = sqlite3.connect(db_path)
+        last = conn.execute('SELECT MAX(seq) FROM change_log').fetchone()[0]
+
+        assert database.prune_change_log(conn.cursor(), keep=2) == last - 2
+        assert database.prune_change_log(conn.cursor(), keep=2) == 0
+        conn.commit()
+        assert conn.execute('SELECT MIN(seq) FROM change_log').fetchone() == (last - 1,)
+        assert database.get_change_log_horizon(conn.cursor()) == last - 2
+
+        conn.execute('DELETE FROM change_log')
+        conn.execute("INSERT INTO movies VALUES (9, 'Nowy', NULL)")
+        conn.commit()
+        assert conn.execute('SELECT seq FROM change_log').fetchone() == (last + 1,)
+        conn.close()
+
+
+# ============ SHARDING TESTS ============
+
+def _shard_rows(db_path):
+    conn = sqlite3.connect(db_path)
+    paths = database.shard_paths(db_path, database.get_shard_count(conn.cursor()))
+    conn.close()
+    ratings, tags = [], []
+    for path in paths:
+        shard = sqlite3.connect(path)
+        ratings += shard.execute('SELECT * FROM ratings').fetchall()
+        tags += shard.execute('SELECT * FROM tags').fetchall()
+        shard.close()
+    return paths, sorted(ratings), sorted(tags)
+
+
+class TestReshard:
+    """Testy dla podziału ocen i tagów na pliki shardów"""
+
+    def test_reshard_round_trip(self, tmp_path):
+        """Podział na shardy i powrót zachowują wszystkie wiersze"""
+        db_path = str(tmp_path / "movies.db")
+        _populate(db_path)
+        _, ratings, tags = _shard_rows(db_path)
+
+        database.reshard(2, db_path)
+        paths, sharded_ratings, sharded_tags = _shard_rows(db_path)
+        assert len(paths) == 2 and db_path not in paths
+        assert (sharded_ratings, sharded_tags) == (ratings, tags)
+        for index, path in enumerate(paths):
+            shard = sqlite3.connect(path)
+            users = {row[0] for row in shard.execute('SELECT userId FROM ratings UNION SELECT userId FROM tags')}
+            assert all(database.shard_index(user, 2) == index for user in users)
+            shard.close()
+
+        database.reshard(3, db_path)
+        database.reshard(1, db_path)
+        paths, ratings_back, tags_back = _shard_rows(db_path)
+        assert paths == [db_path]
+        assert (ratings_back, tags_back) == (ratings, tags)
+
+    def test_failed_reshard_keeps_layout(self, tmp_path, monkeypatch):
+        """Przerwany podział zostawia poprzedni układ, wyzwalacze bazy głównej i żadnych nowych plików"""
+        db_path = str(tmp_path / "movies.db")
+        _populate(db_path)
+        _, ratings, tags = _shard_rows(db_path)
+
+        def fail(cursor, tags):
+            raise sqlite3.OperationalError("przerwany podział")
+        monkeypatch.setattr(database, "intern_tags", fail)
+        with pytest.raises(sqlite3.OperationalError):
+            database.reshard(2, db_path)
+        assert _shard_rows(db_path) == ([db_path], ratings, tags)
+        assert _trigger_count(db_path) == len(database._triggers())
+        assert sorted(p.name for p in tmp_path.iterdir()) == ['movies.db']
+        assert sorted(p.name for p in tmp_path.iterdir() if p.suffix == '.db') == ['movies.db']
+
+    def test_sharded_derived_tables(self, tmp_path):
+        """Shardy mają własne agregaty, a baza główna wspólny słownik tagów"""
+        db_path = str(tmp_path / "movies.db")
+        _populate(db_path)
+        database.reshard(2, db_path)
+
+        conn = sqlite3.connect(db_path)
+        assert conn.execute('SELECT COUNT(*) FROM ratings').fetchone() == (0,)
+        assert sorted(conn.execute('SELECT tag FROM tag_vocabulary').fetchall()) == [('epic',), ('funny',)]
+        conn.close()
+        total = 0
+        for path in database.shard_paths(db_path, 2):
+            shard = sqlite3.connect(path)
+            total += shard.execute('SELECT COALESCE(SUM(count), 0) FROM rating_rollups_weekly').fetchone()[0]
+            shard.close()
+        assert total == 3
+
+    def test_snapshot_of_sharded_database(self, tmp_path):
+        """Migawka obejmuje oceny i tagi ze wszystkich shardów i odtwarza podział"""
+        db_path, snap = str(tmp_path / "movies.db"), str(tmp_path / "movies.snap")
+        _populate(db_path)
+        _, ratings, tags = _shard_rows(db_path)
+        database.reshard(2, db_path)
+
+        assert snapshot.export_snapshot(snap, db_path)['ratings'] == 3
+        shard_files = {path: os.stat(path).st_ino for path in database.shard_paths(db_path, 2)}
+        snapshot.import_snapshot(snap, db_path)
+        paths, restored_ratings, restored_tags = _shard_rows(db_path)
+        assert len(paths) == 2
+        assert (restored_ratings, restored_tags) == (ratings, tags)
+        assert {path: os.stat(path).st_ino for path in paths} == shard_files  # Te same pliki, bez ponownego podziału
+        conn = sqlite3.connect(db_path)
+        assert conn.execute('SELECT COUNT(*) FROM ratings').fetchone() == (0,)
+        assert conn.execute("SELECT COUNT(*) FROM tag_vocabulary WHERE tag = 'epic'").fetchone() == (1,)
+        conn.close()
+
+
+# ============ RATING INDEX TESTS ============
+
+class TestRatingIndex:
+    """Testy dla indeksu ocen mapowanego do pamięci"""
+
+    def test_lookup_matches_table(self, tmp_path):
+        """Wyszukiwanie binarne zwraca te same oceny co tabela"""
+        db_path = str(tmp_path / "movies.db")
+        _populate(db_path)
+        assert rating_index.build_rating_index(db_path) == 3
+
+        index = rating_index.RatingIndex(db_path)
+        assert index.get(1, 2) == {'userId': 1, 'movieId': 2, 'rating': 3.5, 'timestamp': 1000002}
+        assert index.get(2, 1)['rating'] == 4.5
+        assert index.get(2, 2) is None
+        assert index.get(0, 0) is None and index.get(9, 9) is None
+        index.close()
+
+    def test_overlay_applies_newer_writes(self, tmp_path):
+        """Zmiany po zbudowaniu indeksu są widoczne przez nakładkę z dziennika zmian"""
+        db_path = str(tmp_path / "movies.db")
+        _populate(db_path)
+        rating_index.build_rating_index(db_path)
+        index = rating_index.RatingIndex(db_path)
+        assert index.get(1, 1)['rating'] == 5.0
+
+        conn = sqlite3.connect(db_path)
+        conn.execute('INSERT INTO ratings VALUES (3, 3, 1.0, 5)')
+        conn.execute('UPDATE ratings SET rating = 2.0 WHERE userId = 1 AND movieId = 1')
+        conn.execute('DELETE FROM ratings WHERE userId = 2 AND movieId = 1')
+        conn.commit()
+        conn.close()
+
+        assert index.get(3, 3)['rating'] == 1.0
+        assert index.get(1, 1)['rating'] == 2.0
+        assert index.get(2, 1) is None
+        index.close()
+
+    def test_rebuild_switches_atomically(self, tmp_path):
+        """Przebudowany indeks zastępuje poprzedni plik, a czytelnik przełącza się na niego"""
+        db_path = str(tmp_path / "movies.db")
+        _populate(db_path)
+        rating_index.build_rating_index(db_path)
+        index = rating_index.RatingIndex(db_path)
+        conn = sqlite3.connect(db_path)
+        conn.execute('INSERT INTO ratings VALUES (4, 1, 3.0, 6)')
+        conn.commit()
+        conn.close()
+
+        assert rating_index.build_rating_index(db_path) == 4
+        assert index.reload() and not index.reload()
+        assert index.count == 4 and index.get(4, 1)['rating'] == 3.0
+        assert [p.name for p in tmp_path.iterdir() if p.suffix == '.tmp'] == []
+        index.close()
+
+    def test_bulk_replace_invalidates_index(self, tmp_path):
+        """Masowa wymiana danych (np. import migawki) unieważnia indeks do przebudowania"""
+        db_path, snap = str(tmp_path / "movies.db"), str(tmp_path / "movies.snap")
+        _populate(db_path)
+        snapshot.export_snapshot(snap, db_path)
+        rating_index.build_rating_index(db_path)
+        index = rating_index.RatingIndex(db_path)
+
+        snapshot.import_snapshot(snap, db_path)
+        with pytest.raises(rating_index.RatingIndexError):
+            index.get(1, 1)
+        rating_index.build_rating_index(db_path)
+        index.reload()
+        assert index.get(1, 1)['rating'] == 5.0
+        index.close()
+
+    def test_refresh_guarded_by_lock(self, tmp_path):
+        """Indeks przebudowuje tylko proces trzymający blokadę i tylko, gdy wciąż jest zbyt stary"""
+        db_path = str(tmp_path / "movies.db")
+        _populate(db_path)
+        path = rating_index.index_path(db_path)
+        assert rating_index.refresh_rating_index(db_path, 60)
+        assert not rating_index.refresh_rating_index(db_path, 60)
+
+        os.utime(path, (0, 0))
+        lock = tmp_path / (os.path.basename(path) + '.lock')
+        lock.write_text('1')
+        assert not rating_index.refresh_rating_index(db_path, 60)
+        assert os.path.getmtime(path) == 0 and lock.exists()
+
+        os.utime(lock, (0, 0))  # Blokada po przerwanym procesie
+        assert not rating_index.refresh_rating_index(db_path, 60)
+        assert not lock.exists()
+        assert rating_index.refresh_rating_index(db_path, 60)
+        assert os.path.getmtime(path) > 0 and not lock.exists()
+
+    def test_refresh_keeps_lock_taken_over(self, tmp_path, monkeypatch):
+        """Proces nie usuwa blokady, którą w trakcie przebudowy przejął inny proces"""
+        db_path = str(tmp_path / "movies.db")
+        _populate(db_path)
+        lock = tmp_path / (os.path.basename(rating_index.index_path(db_path)) + '.lock')
+
+        def build(path):
+            lock.write_text(str(os.getpid() + 1))  # Blokada uznana za przeterminowaną i zajęta ponownie
+        monkeypatch.setattr(rating_index, "build_rating_index", build)
+        assert rating_index.refresh_rating_index(db_path, 60)
+        assert lock.read_text() == str(os.getpid() + 1)
+
+    def test_refresh_rebuilds_stale_index_once(self, tmp_path):
+        """Unieważniony indeks jest przebudowywany raz - kolejny proces widzi już nowy plik"""
+        db_path, snap = str(tmp_path / "movies.db"), str(tmp_path / "movies.snap")
+        _populate(db_path)
+        snapshot.export_snapshot(snap, db_path)
+        rating_index.build_rating_index(db_path)
+        first, second = rating_index.RatingIndex(db_path), rating_index.RatingIndex(db_path)
+        snapshot.import_snapshot(snap, db_path)
+        for index in (first, second):
+            with pytest.raises(rating_index.RatingIndexError):
+                index.get(1, 1)
+
+        assert rating_index.refresh_rating_index(db_path, 60, first)
+        assert not rating_index.refresh_rating_index(db_path, 60, second)
+        assert second.reload() and second.get(1, 1)['rating'] == 5.0
+        first.close()
+        second.close()
+
+    def test_pruned_log_invalidates_index(self, tmp_path):
+        """Przycięcie dziennika poza zmiany nałożone na indeks wymaga jego przebudowania"""
+        db_path = str(tmp_path / "movies.db")
+        _populate(db_path)
+        rating_index.build_rating_index(db_path)
+        index = rating_index.RatingIndex(db_path)
+        conn = sqlite3.connect(db_path)
+        conn.execute('INSERT INTO ratings VALUES (3, 3, 1.0, 5)')
+        conn.execute('INSERT INTO ratings VALUES (3, 4, 2.0, 6)')
+        conn.commit()
+        database.prune_change_log(conn.cursor(), keep=1)
+        conn.commit()
+        conn.close()
+
+        with pytest.raises(rating_index.RatingIndexError):
+            index.get(3, 3)
+        rating_index.build_rating_index(db_path)
+        index.reload()
+        assert index.get(3, 3)['rating'] == 1.0
+        index.close()
+
+
+# ============ MAINTENANCE TESTS ============
+
+class TestMaintenance:
+    """Testy dla konserwacji plików bazy danych"""
+
+    def _churn(self, db_path):
+        database.create_database(db_path)
+        conn = sqlite3.connect(db_path)
+        conn.execute('CREATE TABLE scratch (payload TEXT)')
+        conn.executemany('INSERT INTO scratch VALUES (?)', [('x' * 200,) for _ in range(2000)])
+        conn.commit()
+        conn.execute('DELETE FROM scratch')
+        conn.commit()
+        conn.close()
+
+    def test_incremental_vacuum_releases_free_pages(self, tmp_path):
+        """Odzyskanie wolnych stron po masowym usunięciu zmniejsza plik bazy"""
+        db_path = str(tmp_path / "movies.db")
+        self._churn(db_path)
+        stats = maintenance.database_stats(db_path)
+        assert stats['auto_vacuum'] == 'incremental' and stats['freelist_count'] > 0
+
+        partial = maintenance.incremental_vacuum(db_path, max_pages=10, step=4)
+        assert partial['freelist_before'] - partial['freelist_after'] == 10
+        report = maintenance.incremental_vacuum(db_path, step=16)
+        assert report['freelist_after'] == 0
+        assert report['pages_after'] == report['pages_before'] - report['freelist_before']
+
+    def test_vacuum_requires_incremental_mode(self, tmp_path):
+        """Baza bez trybu INCREMENTAL musi zostać jednorazowo przełączona"""
+        db_path = str(tmp_path / "legacy.db")
+        conn = sqlite3.connect(db_path)
+        conn.execute('CREATE TABLE t (x)')
+        conn.close()
+        with pytest.raises(maintenance.MaintenanceError):
+            maintenance.incremental_vacuum(db_path)
+
+        maintenance.enable_incremental_vacuum(db_path)
+        assert maintenance.database_stats(db_path)['auto_vacuum'] == 'incremental'
+
+    def test_analyze_collects_statistics(self, tmp_path):
+        """ANALYZE zapisuje statystyki planisty dla indeksów"""
+        db_path = str(tmp_path / "movies.db")
+        _populate(db_path)
+        assert maintenance.analyze(db_path)['operation'] == 'analyze'
+
+        conn = sqlite3.connect(db_path)
+        tables = {row[0] for row in conn.execute('SELECT tbl FROM sqlite_stat1')}
+        conn.close()
+        assert {'ratings', 'tags'} <= tables
+
+    def test_backup_copies_all_shards(self, tmp_path):
+        """Kopia zapasowa obejmuje bazę główną i shardy"""
+        db_path, target = str(tmp_path / "movies.db"), str(tmp_path / "backup.db")
+        _populate(db_path)
+        database.reshard(2, db_path)
+
+        reports = maintenance.backup_all(db_path, target, step=1)
+        assert len(reports) == 3
+        assert _dump(target)['movies'] == _dump(db_path)['movies']
+        assert _shard_rows(target)[1:] == _shard_rows(db_path)[1:]
+        assert maintenance.database_files(target)[1:] == database.shard_paths(target, 2)
+
+    def test_backup_falls_back_under_writes(self, tmp_path, monkeypatch):
+        """Kopia krokowa zaczynana od nowa przez zapisy innego połączenia kończy się przez VACUUM INTO"""
+        db_path, target = str(tmp_path / "movies.db"), str(tmp_path / "backup.db")
+        _populate(db_path)
+        writer = sqlite3.connect(db_path)
+        statements = []
+
+        class WrittenDuringBackup(sqlite3.Connection):
+            def backup(self, destination, *, progress, **kwargs):
+                def write_then_report(status, remaining, total):
+                    writer.execute("INSERT INTO movies (title) VALUES ('Nowy')")
+                    writer.commit()
+                    progress(status, remaining, total)
+                super().backup(destination, progress=write_then_report, **kwargs)
+
+        connect = sqlite3.connect
+
+        def traced_connect(*args, **kwargs):
+            connection = connect(*args, factory=WrittenDuringBackup, **kwargs)
+            connection.set_trace_callback(statements.append)
+            return connection
+
+        monkeypatch.setattr(maintenance.sqlite3, 'connect', traced_connect)
+        maintenance.backup(db_path, target, step=1, max_restarts=2)
+        writer.close()
+
+        assert any(statement.startswith('VACUUM INTO') for statement in statements)
+        assert _dump(target)['ratings'] == _dump(db_path)['ratings']
+        assert [p.name for p in tmp_path.iterdir() if p.suffix == '.tmp'] == []
+
+    def test_vacuum_checkpoint_passive_by_default(self, tmp_path, monkeypatch):
+        """Odzyskanie stron kończy checkpoint PASSIVE, a TRUNCATE tylko na życzenie"""
+        db_path = str(tmp_path / "movies.db")
+        self._churn(db_path)
+        statements = []
+        connect = sqlite3.connect
+
+        def traced_connect(*args, **kwargs):
+            connection = connect(*args, **kwargs)
+            connection.set_trace_callback(statements.append)
+            return connection
+
+        monkeypatch.setattr(maintenance.sqlite3, 'connect', traced_connect)
+        maintenance.incremental_vacuum(db_path, max_pages=4)
+        maintenance.incremental_vacuum(db_path, max_pages=4, truncate_wal=True)
+        checkpoints = [statement for statement in statements if 'wal_checkpoint' in statement]
+        assert checkpoints == ['PRAGMA wal_checkpoint(PASSIVE)', 'PRAGMA wal_checkpoint(TRUNCATE)']